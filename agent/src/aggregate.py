@@ -0,0 +1,98 @@
+"""Per-miner window aggregation: many local samples in, one summary point per window out."""
+import time
+
+DEFAULT_WINDOW = 300.0
+
+GAUGES = ("hashrate", "temperature", "power")  # min / max / mean / last per window
+COUNTERS = ("accepted", "rejected")  # delta per window
+
+
+class _Window:
+    __slots__ = ("start", "samples", "gauges", "counters", "info")
+
+    def __init__(self, start: float):
+        self.start = start
+        self.samples = 0
+        self.gauges: dict[str, list[float]] = {}  # field -> [min, max, sum, count, last]
+        self.counters: dict[str, list[float]] = {}  # field -> [first, last] value seen
+        self.info: dict = {}  # latest sample, for tags and point-in-time fields
+
+
+class WindowAggregator:
+    """
+    Accumulates samples per miner in fixed windows aligned to multiples of
+    `window` seconds, so every miner's windows share the same timestamps.
+    flush() returns the summaries of the windows that have ended.
+
+    Counter deltas are taken against the last value of the previous window,
+    so no increments are lost between windows (a miner's first window counts
+    from its first sample); a counter that went down (miner restarted)
+    counts from zero.
+    """
+
+    def __init__(self, window: float = DEFAULT_WINDOW):
+        self.window = window
+        self._open: dict[str, _Window] = {}
+        self._last_counters: dict[str, dict[str, float]] = {}
+
+    def add(self, info: dict, ts: float | None = None) -> list[tuple[float, dict, dict]]:
+        """Add a sample; returns the miner's previous window if this sample closed it."""
+        ts = ts if ts is not None else time.time()
+        start = ts - ts % self.window
+        mac = info["mac"]
+        closed = []
+        current = self._open.get(mac)
+        if current is not None and current.start != start:
+            closed.append(self._close(mac, current))
+            current = None
+        if current is None:
+            current = self._open[mac] = _Window(start)
+
+        current.samples += 1
+        current.info = info
+        for field in GAUGES:
+            value = _number(info.get(field))
+            if value is None:
+                continue
+            g = current.gauges.get(field)
+            if g is None:
+                current.gauges[field] = [value, value, value, 1, value]
+            else:
+                g[0], g[1] = min(g[0], value), max(g[1], value)
+                g[2] += value
+                g[3] += 1
+                g[4] = value
+        for field in COUNTERS:
+            value = _number(info.get(field))
+            if value is not None:
+                current.counters.setdefault(field, [value, value])[1] = value
+        return closed
+
+    def flush(self, now: float | None = None) -> list[tuple[float, dict, dict]]:
+        """(window start, latest info, aggregate fields) for every window that has ended."""
+        now = now if now is not None else time.time()
+        current_start = now - now % self.window
+        ended = [mac for mac, w in self._open.items() if w.start < current_start]
+        return [self._close(mac, self._open[mac]) for mac in ended]
+
+    def _close(self, mac: str, w: _Window) -> tuple[float, dict, dict]:
+        del self._open[mac]
+        fields = {"samples": w.samples}
+        for field, (lo, hi, total, count, last) in w.gauges.items():
+            fields[f"{field}_min"] = lo
+            fields[f"{field}_max"] = hi
+            fields[f"{field}_last"] = last
+            fields[field] = total / count  # the mean keeps the raw field name, so existing queries still work
+        previous = self._last_counters.setdefault(mac, {})
+        for field, (first, last) in w.counters.items():
+            before = previous.get(field, first)  # a miner's first window counts from its first sample
+            fields[f"{field}_delta"] = last - before if last >= before else last
+            previous[field] = last
+        return w.start, w.info, fields
+
+
+def _number(value) -> float | None:
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return None
@@ -1,16 +1,48 @@
 """Agent configuration from environment."""
 import os
 
+_AGENT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
 
 def get_config():
     """Load config from environment."""
     return {
         "AGENT_TOKEN": os.getenv("AGENT_TOKEN", ""),
         "SERVER_URL": os.getenv("SERVER_URL", "http://localhost:8000").rstrip("/"),
+        "WS_CODEC": os.getenv("WS_CODEC", "msgpack").lower(),  # "msgpack" (JSON if the server lacks it) or "json"
+        "WS_COMPRESSION": os.getenv("WS_COMPRESSION", "deflate").lower(),  # permessage-deflate; "none" saves Pi CPU
+        "METRICS_SINK": os.getenv("METRICS_SINK", "influx").lower(),  # "influx" = write directly, "server" = push over the WebSocket
         "INFLUXDB_URL": os.getenv("INFLUXDB_URL", "http://localhost:8086").rstrip("/"),
         "INFLUXDB_TOKEN": os.getenv("INFLUXDB_TOKEN", ""),
         "INFLUXDB_ORG": os.getenv("INFLUXDB_ORG", "miner-org"),
         "INFLUXDB_BUCKET": os.getenv("INFLUXDB_BUCKET", "miner-metrics"),
-        "SCAN_RANGE": os.getenv("SCAN_RANGE", ""),  # e.g. 192.168.1.0/24
+        "INFLUX_BATCH_SIZE": int(os.getenv("INFLUX_BATCH_SIZE", "5000")),  # max points per write
+        "INFLUX_FLUSH_INTERVAL": float(os.getenv("INFLUX_FLUSH_INTERVAL", "5")),  # seconds before a partial batch is sent
+        "INFLUX_MAX_QUEUE": int(os.getenv("INFLUX_MAX_QUEUE", "50000")),  # points held in memory; oldest dropped beyond
+        "STATE_PATH": os.getenv("STATE_PATH", os.path.join(_AGENT_DIR, "state.db")),  # inventory/identity/scan cache ("" = off)
+        "SPOOL_DIR": os.getenv("SPOOL_DIR", os.path.join(_AGENT_DIR, "spool")),  # failed batches on disk ("" = off)
+        "SPOOL_MAX_MB": float(os.getenv("SPOOL_MAX_MB", "64")),  # oldest data evicted beyond this
+        "SPOOL_REPLAY_RATE": float(os.getenv("SPOOL_REPLAY_RATE", "2")),  # spooled batches per second after recovery
+        "SCAN_RANGE": os.getenv("SCAN_RANGE", ""),  # e.g. 192.168.1.0/24 or 10.0.0.0/22,10.0.8.1-10.0.8.50,!10.0.1.0/24
+        "SCAN_MODE": os.getenv("SCAN_MODE", "full"),  # full | neighbor (ARP table first, rest in background)
+        "SCAN_SLICE_SIZE": int(os.getenv("SCAN_SLICE_SIZE", "4096")),  # addresses per cycle for big ranges (0 = all)
+        "SCAN_BACKOFF_BASE": float(os.getenv("SCAN_BACKOFF_BASE", "240")),  # seconds before re-probing a dead address
+        "SCAN_BACKOFF_MAX": float(os.getenv("SCAN_BACKOFF_MAX", "1800")),  # longest backoff; see README for the bound with slicing
+        "DISCOVERY_INTERVAL": float(os.getenv("DISCOVERY_INTERVAL", "300")),  # LAN sweep, seconds
+        "POLL_INTERVAL": float(os.getenv("POLL_INTERVAL", "15")),  # poll tick = fastest per-miner cadence, seconds
+        "POLL_MAX_INTERVAL": float(os.getenv("POLL_MAX_INTERVAL", "300")),  # slowest cadence for steady miners
+        "POLL_BUDGET": float(os.getenv("POLL_BUDGET", "600")),  # max miner polls per minute
+        "SCHEDULE_JITTER": float(os.getenv("SCHEDULE_JITTER", "0.1")),  # +/- fraction of the interval
+        "HISTORY_HOURS": float(os.getenv("HISTORY_HOURS", "4")),  # recent samples kept in memory per miner
+        # legacy: ip/model/worker/farm_name as tags; stable: only farm_id/agent_id/miner_mac, the rest in miner_info
+        "TAG_SCHEMA": os.getenv("TAG_SCHEMA", "legacy"),
+        "METADATA_INTERVAL": float(os.getenv("METADATA_INTERVAL", "3600")),  # miner_info rewrite when unchanged, seconds
+        "METRICS_MODE": os.getenv("METRICS_MODE", "raw"),  # raw (every poll) | aggregate (one point per window)
+        "AGGREGATE_WINDOW": float(os.getenv("AGGREGATE_WINDOW", "300")),  # seconds per aggregate point
+        "AGGREGATE_SAMPLES": int(os.getenv("AGGREGATE_SAMPLES", "5")),  # polls per window at least (caps POLL_MAX_INTERVAL)
+        # Miners (MACs, comma-separated) that also get every raw sample written in aggregate mode
+        "RAW_MINERS": {m.strip().lower() for m in os.getenv("RAW_MINERS", "").split(",") if m.strip()},
+        "POLL_CONCURRENCY": int(os.getenv("POLL_CONCURRENCY", "64")),  # miner API requests in flight
+        "POLL_TIMEOUT": float(os.getenv("POLL_TIMEOUT", "5")),  # per-miner deadline, seconds
         "WHATSMINER_PORT": int(os.getenv("WHATSMINER_PORT", "4028")),
     }
@@ -0,0 +1,102 @@
+"""Recent samples per miner in fixed-size, array-backed ring buffers."""
+import math
+import time
+from array import array
+
+# Per-sample values kept in the buffer, in column order (float32; NaN = not reported)
+FIELDS = ("hashrate", "temperature", "power", "fan_in", "fan_out", "chip_temp_max", "accepted", "rejected")
+
+DEFAULT_HOURS = 4.0
+DEFAULT_CAPACITY = 960  # 4 hours at the fastest (15s) poll cadence
+
+
+class RingBuffer:
+    """
+    Fixed-capacity time series: one uint32 timestamp column plus one float32
+    column per field, allocated up front and overwritten oldest-first. Costs
+    4 * (1 + len(FIELDS)) bytes per slot no matter how many samples it holds.
+    """
+
+    __slots__ = ("capacity", "ts", "columns", "head", "size")
+
+    def __init__(self, capacity: int):
+        self.capacity = capacity
+        self.ts = array("I", bytes(4 * capacity))
+        self.columns = [array("f", bytes(4 * capacity)) for _ in FIELDS]
+        self.head = 0  # next slot to write
+        self.size = 0
+
+    def append(self, ts: float, values: dict) -> None:
+        i = self.head
+        self.ts[i] = int(ts)
+        for column, field in zip(self.columns, FIELDS):
+            value = values.get(field)
+            try:
+                column[i] = float(value) if value is not None else math.nan
+            except (TypeError, ValueError):
+                column[i] = math.nan
+        self.head = (i + 1) % self.capacity
+        self.size = min(self.size + 1, self.capacity)
+
+    def _slots(self, since: float = 0):
+        """Slot indices oldest to newest with ts >= since."""
+        start = (self.head - self.size) % self.capacity
+        for k in range(self.size):
+            i = (start + k) % self.capacity
+            if self.ts[i] >= since:
+                yield i
+
+    def latest(self) -> dict | None:
+        if not self.size:
+            return None
+        i = (self.head - 1) % self.capacity
+        return {"ts": self.ts[i], **{f: _value(c[i]) for f, c in zip(FIELDS, self.columns)}}
+
+    def since(self, since: float = 0) -> dict:
+        """Columnar {"ts": [...], field: [...]} of the samples at or after `since`."""
+        slots = list(self._slots(since))
+        out = {"ts": [self.ts[i] for i in slots]}
+        for field, column in zip(FIELDS, self.columns):
+            out[field] = [_value(column[i]) for i in slots]
+        return out
+
+
+class MinerHistory:
+    """
+    A RingBuffer per miner MAC, holding at most `capacity` samples and
+    answering queries for the last `hours` hours. Memory is
+    miners * capacity * 4 * (1 + len(FIELDS)) bytes.
+    """
+
+    def __init__(self, hours: float = DEFAULT_HOURS, capacity: int = DEFAULT_CAPACITY):
+        self.window = hours * 3600
+        self.capacity = max(1, capacity)
+        self._buffers: dict[str, RingBuffer] = {}
+
+    def record(self, mac: str, info: dict, ts: float | None = None) -> None:
+        buffer = self._buffers.get(mac)
+        if buffer is None:
+            buffer = self._buffers[mac] = RingBuffer(self.capacity)
+        buffer.append(ts if ts is not None else time.time(), info)
+
+    def latest(self, mac: str) -> dict | None:
+        buffer = self._buffers.get(mac)
+        sample = buffer.latest() if buffer else None
+        if sample and sample["ts"] >= time.time() - self.window:
+            return sample
+        return None
+
+    def recent(self, mac: str, seconds: float | None = None) -> dict | None:
+        """Samples from the last `seconds` (capped at the window), or None for an unknown miner."""
+        buffer = self._buffers.get(mac)
+        if buffer is None:
+            return None
+        seconds = min(seconds, self.window) if seconds else self.window
+        return buffer.since(time.time() - seconds)
+
+    def memory_bytes(self) -> int:
+        return len(self._buffers) * self.capacity * 4 * (1 + len(FIELDS))
+
+
+def _value(x: float) -> float | None:
+    return None if math.isnan(x) else round(x, 3)
@@ -1,49 +1,284 @@
 """Write miner metrics to InfluxDB."""
+import asyncio
+import gzip
 import logging
+import random
+from collections import deque
+from contextlib import suppress
 from datetime import datetime, timezone
-from typing import Any
+from typing import Any, Awaitable, Callable
+
+from spool import Spool
 
 logger = logging.getLogger(__name__)
 
+WRITE_TIMEOUT = 30.0  # seconds per write request
+STABLE_TAGS = frozenset({"farm_id", "agent_id", "miner_mac", "board"})  # tags kept with TAG_SCHEMA=stable
+GZIP_LEVEL = 5  # line protocol compresses ~10x; higher levels cost Pi CPU for little gain
+
+
+_MEASUREMENT_ESCAPES = str.maketrans({",": "\\,", " ": "\\ "})
+_KEY_ESCAPES = str.maketrans({",": "\\,", "=": "\\=", " ": "\\ "})
+_STRING_ESCAPES = str.maketrans({"\\": "\\\\", '"': '\\"'})
+
+
+class InfluxWriteError(Exception):
+    """InfluxDB rejected a write. Retrying only helps for 429 and 5xx."""
+
+    def __init__(self, status: int, message: str):
+        super().__init__(f"HTTP {status}: {message[:200]}")
+        self.status = status
+        self.retryable = status == 429 or status >= 500
+
+
+def _field_value(v: Any) -> str:
+    if isinstance(v, bool):
+        return "1" if v else "0"
+    if isinstance(v, (int, float)):
+        # No "i" suffix: numbers are stored as floats, like the fields already in the bucket
+        return repr(float(v)) if isinstance(v, float) else str(v)
+    return f'"{str(v).translate(_STRING_ESCAPES)}"'
+
+
+def to_line(point: dict, tag_schema: str = "legacy") -> str | None:
+    """
+    One build_point()-style dict as InfluxDB line protocol with second precision.
+    Empty and None tags/fields are left out; None if no field remains.
+    With tag_schema "stable" only STABLE_TAGS are written: IPs, workers, models
+    and farm names change, and every change would start a new series.
+    """
+    fields = ",".join(
+        f"{k.translate(_KEY_ESCAPES)}={_field_value(v)}"
+        for k, v in (point.get("fields") or {}).items()
+        if v is not None and not (isinstance(v, float) and v != v)  # NaN is not valid line protocol
+    )
+    if not fields:
+        return None
+    line = point.get("measurement", "miner_metrics").translate(_MEASUREMENT_ESCAPES)
+    for k, v in sorted((point.get("tags") or {}).items()):  # sorted tags are cheaper for InfluxDB to index
+        if v is not None and v != "" and (tag_schema != "stable" or k in STABLE_TAGS):
+            line += f",{k.translate(_KEY_ESCAPES)}={str(v).translate(_KEY_ESCAPES)}"
+    ts = point.get("timestamp") or datetime.now(timezone.utc)
+    return f"{line} {fields} {int(ts.timestamp()) if isinstance(ts, datetime) else int(ts)}"
+
+
+def _encode_batch(batch: list[str]) -> bytes:
+    """Spool record for a batch: its line protocol."""
+    return "\n".join(batch).encode()
 
-def write_metrics(
-    url: str,
-    token: str,
-    org: str,
-    bucket: str,
-    points: list[dict],
-) -> bool:
+
+def _decode_batch(record: bytes) -> list[str]:
+    return record.decode().split("\n")
+
+
+class InfluxWriter:
     """
-    Write metrics to InfluxDB.
-    Each point: {measurement, tags: {farm_id, farm_name, agent_id, miner_mac, ...}, fields: {hashrate, temp, ...}, timestamp}
+    Long-lived InfluxDB writer. submit() serializes points to line protocol
+    and appends them to an in-memory queue; a background task flushes it in
+    batches of up to batch_size points, or every flush_interval seconds, as
+    one gzipped request on a pooled HTTP session.
+    Failed batches are retried with exponential backoff unless InfluxDB
+    rejected the data itself (4xx other than 429), which is dropped. When the queue is
+    full the oldest points are dropped. close() flushes what is left.
+
+    With a spool, batches that still fail are appended to it instead of being
+    dropped, and while InfluxDB is down new batches go there after a single
+    attempt. Once a write succeeds again the spool is replayed oldest first,
+    at most replay_rate batches per second, alongside the live data.
+
+    transport, if given, replaces the HTTP write: an async callable taking the
+    batch's lines (used to push metrics through the server instead). Errors
+    with a retry_after attribute stretch the backoff to at least that long.
     """
-    if not points:
-        return True
-
-    try:
-        from influxdb_client import InfluxDBClient, Point
-        from influxdb_client.client.write_api import SYNCHRONOUS
-
-        with InfluxDBClient(url=url, token=token, org=org) as client:
-            write_api = client.write_api(write_options=SYNCHRONOUS)
-            influx_points = []
-            for p in points:
-                pt = Point(p.get("measurement", "miner_metrics"))
-                for k, v in (p.get("tags") or {}).items():
-                    if v is not None:
-                        pt = pt.tag(k, str(v))
-                for k, v in (p.get("fields") or {}).items():
-                    if v is not None:
-                        pt = pt.field(k, float(v) if isinstance(v, (int, float)) else v)
-                ts = p.get("timestamp") or datetime.now(timezone.utc)
-                pt = pt.time(ts)
-                influx_points.append(pt)
-            write_api.write(bucket=bucket, org=org, record=influx_points)
-        return True
-    except Exception as e:
-        logger.exception("InfluxDB write failed: %s", e)
+
+    def __init__(
+        self,
+        url: str,
+        token: str,
+        org: str,
+        bucket: str,
+        batch_size: int = 5000,
+        flush_interval: float = 5.0,
+        max_queue: int = 50000,
+        max_retries: int = 5,
+        retry_base: float = 1.0,
+        retry_max: float = 30.0,
+        spool: Spool | None = None,
+        replay_rate: float = 2.0,
+        tag_schema: str = "legacy",
+        transport: Callable[[list[str]], Awaitable[None]] | None = None,
+    ):
+        self.url, self.token, self.org, self.bucket = url, token, org, bucket
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.max_retries = max_retries
+        self.retry_base = retry_base
+        self.retry_max = retry_max
+        self._queue: deque[str] = deque(maxlen=max_queue)
+        self._ready = asyncio.Event()
+        self._task: asyncio.Task | None = None
+        self._closing = False
+        self._session = None
+        self.spool = spool
+        self.replay_rate = replay_rate
+        self.tag_schema = tag_schema
+        self.transport = transport
+        self._healthy = True  # last write succeeded
+        self.stats = {"written": 0, "failed": 0, "dropped": 0, "retries": 0, "spooled": 0, "replayed": 0}
+
+    def start(self) -> None:
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    def submit(self, points: list[dict]) -> None:
+        """Queue points for writing; never blocks."""
+        points = [line for line in (to_line(p, self.tag_schema) for p in points) if line]
+        overflow = len(self._queue) + len(points) - self._queue.maxlen
+        if overflow > 0:
+            self.stats["dropped"] += min(overflow, len(self._queue) + len(points))
+            logger.warning("InfluxDB queue full; dropping %d oldest points", overflow)
+        self._queue.extend(points)
+        if len(self._queue) >= self.batch_size:
+            self._ready.set()
+
+    def queued(self) -> int:
+        return len(self._queue)
+
+    def status(self) -> dict:
+        """Counters plus current queue and spool depth."""
+        return {**self.stats, "queued": len(self._queue), "spool": self.spool.depth() if self.spool is not None else None}
+
+    async def close(self) -> None:
+        """Stop the flusher and write everything still queued (one attempt per batch)."""
+        self._closing = True  # wait_for() can swallow a cancel that races with the event; the flag cannot be missed
+        if self._task:
+            self._task.cancel()
+            with suppress(asyncio.CancelledError):
+                await self._task
+            self._task = None
+        while self._queue:
+            await self._write_batch(self._take(), retries=0)
+        if self.spool is not None:
+            await asyncio.to_thread(self.spool.close)
+        if self._session is not None:
+            await self._session.close()
+            self._session = None
+
+    async def _run(self) -> None:
+        while not self._closing:
+            replaying = self._healthy and self.spool is not None and len(self.spool) > 0
+            with suppress(asyncio.TimeoutError):
+                await asyncio.wait_for(self._ready.wait(), timeout=0 if replaying else self.flush_interval)
+            self._ready.clear()
+            # Full batches go out back to back; a partial batch waits for the interval
+            while self._queue and not self._closing:
+                batch = self._take()
+                try:
+                    await self._write_batch(batch, self.max_retries)
+                except asyncio.CancelledError:
+                    # Shutting down mid-write: hand the batch back to close() (a repeat write is harmless,
+                    # InfluxDB overwrites points with the same series and timestamp)
+                    self._queue.extendleft(reversed(batch))
+                    raise
+                if len(self._queue) < self.batch_size:
+                    break
+            if replaying:
+                await self._replay()
+
+    async def _replay(self) -> None:
+        """Replay spooled batches, paced by replay_rate, for about one flush interval."""
+        for _ in range(max(1, int(self.replay_rate * self.flush_interval))):
+            if self._closing or self._ready.is_set() or not self._healthy:
+                return
+            record = await asyncio.to_thread(self.spool.peek)
+            if record is None:
+                return
+            batch = _decode_batch(record)
+            try:
+                await self._write(batch)
+            except InfluxWriteError as e:
+                if e.retryable:
+                    self._healthy = False
+                    logger.warning("InfluxDB replay failed, pausing: %s", e)
+                    return
+                logger.error("InfluxDB rejected %d spooled points, dropping: %s", len(batch), e)
+                self.stats["failed"] += len(batch)
+            except Exception as e:
+                self._healthy = False
+                logger.warning("InfluxDB replay failed, pausing: %s", e)
+                return
+            else:
+                self.stats["written"] += len(batch)
+                self.stats["replayed"] += len(batch)
+            await asyncio.to_thread(self.spool.commit)
+            await asyncio.sleep(1 / self.replay_rate)
+
+    def _take(self) -> list[str]:
+        return [self._queue.popleft() for _ in range(min(self.batch_size, len(self._queue)))]
+
+    async def _write_batch(self, batch: list[str], retries: int) -> bool:
+        if not self._healthy and self.spool is not None:
+            retries = 0  # known outage: one attempt, then straight to the spool
+        for attempt in range(retries + 1):
+            try:
+                await self._write(batch)
+                self.stats["written"] += len(batch)
+                if not self._healthy:
+                    logger.info("InfluxDB writes recovered")
+                self._healthy = True
+                return True
+            except Exception as e:
+                if isinstance(e, InfluxWriteError) and not e.retryable:
+                    self._healthy = True  # InfluxDB is up, it just refused this data
+                    logger.error("InfluxDB rejected %d points, dropping: %s", len(batch), e)
+                    break
+                if attempt == retries:
+                    self._healthy = False
+                    if self.spool is not None:
+                        await self._spool_batch(batch, e)
+                        return False
+                    logger.error("InfluxDB write of %d points failed, dropping: %s", len(batch), e)
+                    break
+                delay = min(self.retry_max, self.retry_base * 2 ** attempt) * random.uniform(0.5, 1.0)
+                delay = max(delay, getattr(e, "retry_after", None) or 0)
+                self.stats["retries"] += 1
+                logger.warning("InfluxDB write failed (%s); retrying in %.1fs", e, delay)
+                await asyncio.sleep(delay)
+        self.stats["failed"] += len(batch)
         return False
 
+    async def _spool_batch(self, batch: list[str], error: Exception) -> None:
+        try:
+            await asyncio.to_thread(self.spool.append, _encode_batch(batch))
+        except Exception as e:
+            logger.error("InfluxDB write of %d points failed (%s) and spooling failed, dropping: %s", len(batch), error, e)
+            self.stats["failed"] += len(batch)
+            return
+        self.stats["spooled"] += len(batch)
+        logger.warning("InfluxDB write of %d points failed, spooled to disk: %s", len(batch), error)
+
+    async def _write(self, batch: list[str]) -> None:
+        """POST the batch as one gzipped line-protocol body on the shared session."""
+        if self.transport is not None:
+            await self.transport(batch)
+            return
+        import aiohttp
+
+        if self._session is None:
+            self._session = aiohttp.ClientSession(
+                headers={"Authorization": f"Token {self.token}"},
+                timeout=aiohttp.ClientTimeout(total=WRITE_TIMEOUT),
+            )
+        body = await asyncio.to_thread(gzip.compress, "\n".join(batch).encode(), GZIP_LEVEL)
+        async with self._session.post(
+            f"{self.url}/api/v2/write",
+            params={"org": self.org, "bucket": self.bucket, "precision": "s"},
+            data=body,
+            headers={"Content-Encoding": "gzip", "Content-Type": "text/plain; charset=utf-8"},
+        ) as resp:
+            if resp.status >= 300:
+                raise InfluxWriteError(resp.status, await resp.text())
+
 
 def build_point(
     miner_mac: str,
@@ -81,3 +316,43 @@ def build_point(
             **{k: v for k, v in kwargs.items() if v is not None},
         },
     }
+
+
+def build_board_point(
+    miner_mac: str,
+    board: str,
+    farm_id: str | int,
+    farm_name: str,
+    agent_id: str | int,
+    **fields,
+) -> dict:
+    """Build an InfluxDB point for one hashboard of a miner."""
+    return {
+        "measurement": "miner_board",
+        "tags": {
+            "farm_id": str(farm_id),
+            "farm_name": farm_name,
+            "agent_id": str(agent_id),
+            "miner_mac": miner_mac,
+            "board": board,
+        },
+        "fields": {k: v for k, v in fields.items() if v is not None},
+    }
+
+
+def build_agent_point(farm_id: str | int, farm_name: str, agent_id: str | int, **fields) -> dict:
+    """Build an InfluxDB point for the agent itself (writer queue, spool depth, WebSocket encoding stats)."""
+    return {
+        "measurement": "agent_status",
+        "tags": {"farm_id": str(farm_id), "farm_name": farm_name, "agent_id": str(agent_id)},
+        "fields": {k: v for k, v in fields.items() if v is not None},
+    }
+
+
+def build_info_point(miner_mac: str, farm_id: str | int, farm_name: str, agent_id: str | int, **fields) -> dict:
+    """Build a low-rate miner metadata point (address, model, worker, firmware) for TAG_SCHEMA=stable."""
+    return {
+        "measurement": "miner_info",
+        "tags": {"farm_id": str(farm_id), "agent_id": str(agent_id), "miner_mac": miner_mac},
+        "fields": {"farm_name": farm_name, **{k: v for k, v in fields.items() if v is not None and v != ""}},
+    }
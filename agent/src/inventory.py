@@ -0,0 +1,76 @@
+"""Known miners keyed by MAC, with a reverse IP index for DHCP churn."""
+import time
+from collections import deque
+
+FREED_IPS_KEPT = 64
+
+
+class MinerInventory:
+    """
+    MAC -> miner info map plus an IP -> MAC index.
+    Addresses a miner moved away from (or vanished from) are remembered as
+    recently freed: under DHCP they are the likeliest new home of another miner.
+    """
+
+    def __init__(self):
+        self.miners: dict[str, dict] = {}
+        self.by_ip: dict[str, str] = {}
+        self.freed: deque[str] = deque(maxlen=FREED_IPS_KEPT)
+
+    def __contains__(self, mac: str) -> bool:
+        return mac in self.miners
+
+    def __len__(self) -> int:
+        return len(self.miners)
+
+    def get(self, mac: str) -> dict | None:
+        return self.miners.get(mac)
+
+    def values(self):
+        return self.miners.values()
+
+    def restore(self, miners: dict[str, dict]) -> None:
+        """Load miners saved by a previous run; their addresses are re-verified before use."""
+        for mac, info in miners.items():
+            self.miners[mac] = info
+            if info.get("ip"):
+                self.by_ip[info["ip"]] = mac
+
+    def mac_for_ip(self, ip: str) -> str | None:
+        return self.by_ip.get(ip)
+
+    def update(self, mac: str, ip: str, info: dict) -> None:
+        """Record a miner seen at ip (verified by its summary)."""
+        previous = self.miners.get(mac)
+        old_ip = previous.get("ip") if previous else None
+        if old_ip and old_ip != ip:
+            self._free(old_ip, mac)
+
+        # Another miner still indexed at this address has moved; never send it commands here
+        holder = self.by_ip.get(ip)
+        if holder and holder != mac and holder in self.miners:
+            self.miners[holder]["last_ip"] = ip  # still a good starting point to search from
+            self.miners[holder]["ip"] = None
+
+        self.miners[mac] = {**(previous or {}), **info, "ip": ip, "last_seen": time.time()}
+        self.by_ip[ip] = mac
+
+    def mark_missing(self, mac: str) -> None:
+        """The miner did not answer at its address; the address may be handed out again."""
+        miner = self.miners.get(mac)
+        if miner and miner.get("ip"):
+            # Keep the index entry: if another miner shows up here, update() unlinks this one
+            self._remember_freed(miner["ip"])
+
+    def recently_freed(self) -> list[str]:
+        return list(reversed(self.freed))
+
+    def _free(self, ip: str, mac: str) -> None:
+        if self.by_ip.get(ip) == mac:
+            del self.by_ip[ip]
+        self._remember_freed(ip)
+
+    def _remember_freed(self, ip: str) -> None:
+        if ip in self.freed:
+            self.freed.remove(ip)
+        self.freed.append(ip)
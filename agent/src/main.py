@@ -5,14 +5,26 @@ Miner Agent - runs on Raspberry Pi, scans LAN for WhatsMiners, sends metrics to
 import asyncio
 import json
 import logging
+import math
+import random
+import signal
 import sys
+import time
+from contextlib import suppress
 from datetime import datetime, timezone
 
 from config import get_config
-from scanner import scan_for_miners
-from miner_client import get_summary, extract_miner_info, exec_command
-from influx_writer import write_metrics, build_point
-from server_client import run_websocket
+from scanner import discover_miners, identify_miner, locate_miner, last_scan_stats
+from scan_cache import ScanCache
+from poll_schedule import PollScheduler
+from inventory import MinerInventory
+from history import MinerHistory
+from aggregate import WindowAggregator
+from miner_client import StaticInfoCache, exec_command, poll_miners, update_pools
+from influx_writer import InfluxWriter, build_agent_point, build_board_point, build_info_point, build_point
+from spool import Spool
+from state_store import StateStore
+from server_client import codec_stats, run_websocket, send_metrics
 
 logging.basicConfig(
     level=logging.INFO,
@@ -21,75 +33,558 @@ logging.basicConfig(
 )
 logger = logging.getLogger(__name__)
 
-# Global state: known miners {mac: {ip, model, ...}}
-_miners_cache: dict = {}
+# Global state: known miners {mac: {ip, model, ...}} with an IP -> MAC index
+_miners_cache = MinerInventory()
 _agent_info: dict = {}  # farm_id, farm_name, agent_id from server
+_scan_cache: ScanCache | None = None  # live/dead probe results, kept across cycles
+_poll_scheduler: PollScheduler | None = None  # per-miner poll cadence
+_history: MinerHistory | None = None  # recent samples per miner, fixed memory
+_influx_writer: InfluxWriter | None = None  # batched background writes, started in main()
+_aggregator: WindowAggregator | None = None  # METRICS_MODE=aggregate only
+_state: StateStore | None = None  # inventory, identity and scan cache on disk, opened in main()
+_static_info = StaticInfoCache()  # firmware, PSU and pool URLs, re-read hourly or after a reboot
+_info_written: dict[str, tuple[tuple, float]] = {}  # mac -> (metadata, when written) for TAG_SCHEMA=stable
+_miner_locks: dict[str, asyncio.Lock] = {}  # one command at a time per miner
+_relocation_task: asyncio.Task | None = None  # background re-location of miners that stopped answering
+_scan_lock = asyncio.Lock()  # one LAN sweep at a time: periodic discovery and server-requested rescans
+
+SCAN_PROGRESS_INTERVAL = 0.5  # seconds between batched scan_progress messages
+RELOCATE_WINDOW = 600  # seconds after a miner drops out during which polls try to re-locate it
+POLL_DEADLINE_SHARE = 0.7  # of POLL_INTERVAL spent polling; the rest of the tick writes and saves
+RELOCATE_CONCURRENCY = 8
+RELOCATE_BUDGET = 120.0  # seconds per background relocation run, independent of the poll deadline
+BULK_ACTIONS = ("restart", "power_off", "power_on", "update_worker")
+BULK_MAX_CONCURRENCY = 64
+BULK_RESULT_INTERVAL = 1.0  # seconds between batched command_result messages of a bulk command
+BULK_RESULT_BATCH = 100  # per-miner results per message at most
+
+
+def _get_scan_cache(config: dict) -> ScanCache:
+    global _scan_cache
+    if _scan_cache is None:
+        _scan_cache = ScanCache(config["SCAN_BACKOFF_BASE"], config["SCAN_BACKOFF_MAX"])
+    return _scan_cache
+
+
+def _get_poll_scheduler(config: dict) -> PollScheduler:
+    global _poll_scheduler
+    if _poll_scheduler is None:
+        max_interval = config["POLL_MAX_INTERVAL"]
+        if config["METRICS_MODE"] == "aggregate":
+            # Steady miners still get AGGREGATE_SAMPLES polls per window, so min/max/mean mean something
+            max_interval = min(max_interval, config["AGGREGATE_WINDOW"] / max(config["AGGREGATE_SAMPLES"], 1))
+        _poll_scheduler = PollScheduler(config["POLL_INTERVAL"], max_interval, config["POLL_BUDGET"])
+    return _poll_scheduler
+
+
+def _get_history(config: dict) -> MinerHistory:
+    global _history
+    if _history is None:
+        hours = config["HISTORY_HOURS"]
+        # Enough slots for the whole window at the fastest poll cadence
+        _history = MinerHistory(hours, math.ceil(hours * 3600 / max(config["POLL_INTERVAL"], 1.0)))
+    return _history
+
+
+def _get_aggregator(config: dict) -> WindowAggregator | None:
+    global _aggregator
+    if _aggregator is None and config["METRICS_MODE"] == "aggregate":
+        _aggregator = WindowAggregator(config["AGGREGATE_WINDOW"])
+    return _aggregator
+
+
+def _restore_state(config: dict) -> None:
+    """Open the state store and load the previous run's inventory, identity and scan cache."""
+    global _state
+    if not config["STATE_PATH"]:
+        return
+    try:
+        _state = StateStore(config["STATE_PATH"])
+        _miners_cache.restore(_state.load_miners())
+        _agent_info.update(_state.load_identity(config["AGENT_TOKEN"]) or {})
+        cache = _get_scan_cache(config)
+        _state.load_scan_cache(cache)
+    except Exception as e:  # a damaged store must not keep the agent from starting
+        logger.warning("Could not load agent state from %s: %s", config["STATE_PATH"], e)
+        return
+    logger.info(
+        "Restored %d miners, %s, scan cache %s from %s",
+        len(_miners_cache), "agent info" if _agent_info else "no agent info", cache.stats(), config["STATE_PATH"],
+    )
 
 
-async def collect_metrics_and_send(config: dict):
-    """Scan miners, get summary, write to InfluxDB."""
-    port = config["WHATSMINER_PORT"]
-    scan_range = config["SCAN_RANGE"] or None
+async def _save_state(config: dict, scan: bool = False) -> None:
+    """Persist inventory changes (and, at most every half hour or when forced, the scan cache)."""
+    if _state is None:
+        return
+    # Snapshots are taken here on the event loop; the thread only serializes and writes
+    miners = {mac: dict(info) for mac, info in _miners_cache.miners.items()}
+    cache = _get_scan_cache(config)
+    scan_snapshot = (dict(cache.live), dict(cache.dead)) if scan or _state.scan_save_due() else None
+    try:
+        await asyncio.to_thread(_state.save_miners, miners)
+        if scan_snapshot:
+            await asyncio.to_thread(_state.save_scan_cache, *scan_snapshot)
+    except Exception as e:
+        logger.warning("Could not save agent state: %s", e)
 
-    ips = await scan_for_miners(scan_range, port)
-    points = []
-    miners_to_report = []
 
-    for ip in ips:
-        summary = get_summary(ip, port)
-        if not summary:
-            continue
+def _remember_miner(config: dict, info: dict) -> None:
+    """Record a miner verified at info["ip"] in the inventory and the scan cache."""
+    _miners_cache.update(info["mac"], info["ip"], info)
+    _get_scan_cache(config).record(info["ip"], True)
 
-        info = extract_miner_info(summary)
-        if not info or not info.get("mac"):
-            continue
 
-        mac = info["mac"]
-        _miners_cache[mac] = {"ip": ip, "model": info.get("model"), **info}
-        miners_to_report.append({"mac": mac, "ip": ip, "model": info.get("model")})
+async def _resolve_miner(mac: str, config: dict, full_sweep: bool = True) -> dict | None:
+    """
+    Current info of a miner, verified by the MAC in its summary. If the cached
+    address is stale (DHCP), re-locate it: neighbor table, nearby and recently
+    freed addresses, then (if full_sweep) a full sweep.
+    """
+    port = config["WHATSMINER_PORT"]
+    miner = _miners_cache.get(mac) or {}
+    if miner.get("ip"):
+        info = await identify_miner(miner["ip"], port)
+        if info and info["mac"].lower() == mac.lower():
+            _remember_miner(config, info)
+            return info
+        _miners_cache.mark_missing(mac)
+
+    info = await locate_miner(
+        mac, miner.get("ip") or miner.get("last_ip"), config["SCAN_RANGE"] or None, port,
+        recently_freed=_miners_cache.recently_freed(), full_sweep=full_sweep,
+    )
+    if info:
+        _remember_miner(config, info)
+    return info
+
+
+async def _exec_on_miner(mac: str, config: dict, action, full_sweep: bool = True) -> tuple[dict | None, str | None]:
+    """
+    Run action(ip) -> result | None on the miner's verified address.
+    If it fails and the miner has moved meanwhile, retry once at the new address.
+    Returns (result, error).
+    """
+    info = await _resolve_miner(mac, config, full_sweep)
+    if not info:
+        return None, "miner not found"
+    result = await action(info["ip"])
+    if result is None:
+        moved = await _resolve_miner(mac, config, full_sweep)
+        if moved and moved["ip"] != info["ip"]:
+            result = await action(moved["ip"])
+    return result, None if result is not None else "exec failed"
+
+
+def _recently_seen(mac: str) -> bool:
+    miner = _miners_cache.get(mac)
+    return bool(miner) and time.time() - miner.get("last_seen", 0) <= RELOCATE_WINDOW
+
+
+async def _relocate_missing(config: dict, macs: list[str]) -> list[dict]:
+    """
+    Cheap re-location (no full sweep) of recently seen miners that did not answer a poll.
+    Each miner found is recorded at its new address right away, so a run cut short
+    by its budget keeps what it found; they are polled there on the next tick.
+    """
+    semaphore = asyncio.Semaphore(RELOCATE_CONCURRENCY)
+    scheduler = _get_poll_scheduler(config)
+
+    async def relocate(mac: str) -> dict | None:
+        miner = _miners_cache.get(mac)
+        _miners_cache.mark_missing(mac)
+        async with semaphore:
+            info = await locate_miner(
+                mac, miner.get("ip") or miner.get("last_ip"), config["SCAN_RANGE"] or None, config["WHATSMINER_PORT"],
+                recently_freed=_miners_cache.recently_freed(), full_sweep=False,
+            )
+        if info:
+            _remember_miner(config, info)
+            scheduler.record(info["mac"], info)
+        return info
+
+    results = await asyncio.gather(*(relocate(mac) for mac in macs if _recently_seen(mac)))
+    return [info for info in results if info]
+
+
+async def _relocate_in_background(config: dict, macs: list[str]) -> None:
+    try:
+        found = await asyncio.wait_for(_relocate_missing(config, macs), timeout=RELOCATE_BUDGET)
+    except asyncio.TimeoutError:
+        logger.warning("Relocation of %d missing miners hit its %.0fs budget", len(macs), RELOCATE_BUDGET)
+        return
+    except Exception as e:
+        logger.warning("Relocation failed: %s", e)
+        return
+    if found:
+        logger.info("Relocated %d of %d missing miners", len(found), len(macs))
+
+
+def _start_relocation(config: dict, macs: list[str]) -> None:
+    """
+    Re-locate missing miners off the poll tick, with their own time budget, so
+    miners that hang a connection cannot cost the tick its points. One run at a
+    time; miners still missing are picked up by a later tick.
+    """
+    global _relocation_task
+    macs = [mac for mac in macs if _recently_seen(mac)]
+    if not macs or (_relocation_task is not None and not _relocation_task.done()):
+        return
+    _relocation_task = asyncio.create_task(_relocate_in_background(config, macs))
+
+
+# Numeric telemetry fields written alongside the summary ones (see miner_client.get_telemetry)
+EXTRA_FIELDS = (
+    "power", "power_limit", "power_rate", "fan_in", "fan_out", "env_temperature", "chip_temp_max",
+    "freq_avg", "uptime", "pools_alive", "pool_active", "pool_rejected", "pool_stale",
+)
 
-        if not _agent_info:
-            continue  # Not yet registered with server
 
-        pt = build_point(
-            miner_mac=mac,
-            miner_ip=ip,
-            miner_model=info.get("model"),
-            worker=info.get("worker"),
+def _build_miner_points(info: dict, aggregates: dict | None = None, ts: datetime | None = None) -> list[dict]:
+    """Miner point plus one point per hashboard. aggregates (window mode) replace/extend the sample's fields."""
+    now = ts or datetime.now(timezone.utc)
+    aggregates = aggregates or {}
+    error_codes = info.get("error_codes")
+    tags = {
+        "farm_id": _agent_info.get("farm_id", ""),
+        "farm_name": _agent_info.get("farm_name", ""),
+        "agent_id": _agent_info.get("agent_id", ""),
+    }
+    pt = build_point(
+        miner_mac=info["mac"],
+        miner_ip=info["ip"],
+        miner_model=info.get("model"),
+        worker=info.get("worker"),
+        error_count=len(error_codes) if error_codes is not None else None,
+        error_codes=",".join(error_codes) if error_codes else None,
+        **tags,
+        **{
+            k: info.get(k)
+            for k in ("hashrate", "temperature", "elapsed", "accepted", "rejected", *EXTRA_FIELDS)
+            if k not in aggregates
+        },
+        **aggregates,
+    )
+    pt["timestamp"] = now
+    points = [pt]
+    for board in info.get("boards") or []:
+        bp = build_board_point(miner_mac=info["mac"], **tags, **board)
+        bp["timestamp"] = now
+        points.append(bp)
+    return points
+
+
+INFO_FIELDS = ("ip", "model", "worker", "firmware", "psu_model")
+
+
+def _build_info_points(config: dict, found: list[dict]) -> list[dict]:
+    """
+    With TAG_SCHEMA=stable, the attributes dropped from the tags go to miner_info:
+    written when they change and otherwise every METADATA_INTERVAL seconds.
+    """
+    if config["TAG_SCHEMA"] != "stable":
+        return []
+    now = time.time()
+    points = []
+    for info in found:
+        metadata = tuple(info.get(k) for k in INFO_FIELDS)
+        written = _info_written.get(info["mac"])
+        if written and written[0] == metadata and now - written[1] < config["METADATA_INTERVAL"]:
+            continue
+        _info_written[info["mac"]] = (metadata, now)
+        pt = build_info_point(
+            miner_mac=info["mac"],
             farm_id=_agent_info.get("farm_id", ""),
             farm_name=_agent_info.get("farm_name", ""),
             agent_id=_agent_info.get("agent_id", ""),
-            hashrate=info.get("hashrate"),
-            temperature=info.get("temperature"),
-            elapsed=info.get("elapsed"),
-            accepted=info.get("accepted"),
-            rejected=info.get("rejected"),
+            **dict(zip(INFO_FIELDS, metadata)),
         )
         pt["timestamp"] = datetime.now(timezone.utc)
         points.append(pt)
-
-    if points and config.get("INFLUXDB_TOKEN"):
-        ok = write_metrics(
-            config["INFLUXDB_URL"],
-            config["INFLUXDB_TOKEN"],
-            config["INFLUXDB_ORG"],
-            config["INFLUXDB_BUCKET"],
-            points,
+    return points
+
+
+def _write_points(config: dict, points: list[dict]) -> None:
+    """Hand points to the background InfluxDB writer; never waits on InfluxDB."""
+    if not _influx_writer:
+        return
+    status = _influx_writer.status()
+    spool = status["spool"] or {}
+    if spool.get("records"):
+        logger.info("InfluxDB spool: %s, replayed %d points so far", spool, status["replayed"])
+    if _agent_info:
+        # Timestamped now, so depth during an outage shows up once the spool is replayed
+        pt = build_agent_point(
+            farm_id=_agent_info.get("farm_id", ""),
+            farm_name=_agent_info.get("farm_name", ""),
+            agent_id=_agent_info.get("agent_id", ""),
+            queued=status["queued"],
+            dropped=status["dropped"],
+            spool_records=spool.get("records"),
+            spool_bytes=spool.get("bytes"),
+            spool_evicted=spool.get("evicted"),
+            **{f"ws_{k}": v for k, v in codec_stats().items()},
         )
-        logger.info("Wrote %d points to InfluxDB: %s", len(points), "ok" if ok else "failed")
+        pt["timestamp"] = datetime.now(timezone.utc)
+        points = [*points, pt]
+    _influx_writer.submit(points)
+
+
+async def run_discovery(config: dict, on_found=None) -> list[dict]:
+    """
+    Sweep the LAN for miners and update the inventory (summary comes back on the
+    probe connection). Returns [{mac, ip, model}] for the server.
+    on_found(miner) is called with {mac, ip, model} as each miner is identified.
+    """
+    miners, _ = await _discover(config, on_found)
+    return miners
+
+
+async def _discover(config: dict, on_found=None) -> tuple[list[dict], dict]:
+    """run_discovery, also returning this sweep's stats (taken under the scan lock)."""
+    # Known miners are in the scan cache's live set, so they are re-checked every
+    # sweep even when a large range is swept in slices
+    async with _scan_lock:
+        found = await discover_miners(
+            config["SCAN_RANGE"] or None,
+            config["WHATSMINER_PORT"],
+            mode=config["SCAN_MODE"],
+            slice_size=config["SCAN_SLICE_SIZE"],
+            cache=_get_scan_cache(config),
+            on_found=(lambda info: on_found({"mac": info["mac"], "ip": info["ip"], "model": info.get("model")}))
+            if on_found else None,
+        )
+        stats = dict(last_scan_stats)
+    for info in found:
+        _remember_miner(config, info)
+    await _save_state(config)
+    return [{"mac": info["mac"], "ip": info["ip"], "model": info.get("model")} for info in found], stats
+
+
+async def poll_known_miners(config: dict) -> None:
+    """
+    Poll the known miners that are due under their adaptive cadence (bounded
+    concurrency, per-miner deadline), write their points to InfluxDB, then
+    start re-locating the ones that stopped answering in the background.
+    Polling stops after POLL_DEADLINE_SHARE of the tick; results are recorded
+    as they come in, and whatever was collected is written even if the tick is
+    cut short. Miners that did not answer in time count as failed polls.
+    """
+    loop = asyncio.get_running_loop()
+    started = loop.time()
+    scheduler = _get_poll_scheduler(config)
+    history = _get_history(config)
+    aggregator = _get_aggregator(config)
+    due = scheduler.due(list(_miners_cache.miners))
+    expected = {}  # ip -> mac we expect to answer there
+    missing = []  # due miners that did not answer at their address (moved, or down)
+    for mac in due:
+        ip = _miners_cache.get(mac).get("ip")
+        if ip:
+            expected[ip] = mac
+        else:
+            missing.append(mac)
+
+    found = []
+    found_macs = set()
+    unanswered = set(expected)  # not done by the poll deadline
+    points = []
+    closed = []  # (window start, info, aggregates) in aggregate mode
+    try:
+        async for ip, info in poll_miners(
+            list(expected), config["WHATSMINER_PORT"], config["POLL_CONCURRENCY"], config["POLL_TIMEOUT"],
+            _static_info, deadline=config["POLL_INTERVAL"] * POLL_DEADLINE_SHARE,
+        ):
+            unanswered.discard(ip)
+            if not info or info["mac"] != expected[ip]:
+                missing.append(expected[ip])
+            if not info:
+                continue
+            found.append(info)
+            found_macs.add(info["mac"])
+            _remember_miner(config, info)
+            scheduler.record(info["mac"], info)
+            history.record(info["mac"], info)
+            if aggregator:
+                closed += aggregator.add(info)
+            if not _agent_info:  # Not yet registered with server otherwise
+                continue
+            if not aggregator:
+                points.extend(_build_miner_points(info))
+            elif info["mac"].lower() in config["RAW_MINERS"]:
+                # Raw stream in its own measurements, so it does not mix with the window aggregates
+                for pt in _build_miner_points(info):
+                    pt["measurement"] += "_raw"
+                    points.append(pt)
+    finally:
+        for ip in unanswered:
+            scheduler.record(expected[ip], None)
+        for mac in missing:
+            if mac not in found_macs:
+                scheduler.record(mac, None)
+        if _agent_info:
+            points += _build_info_points(config, found)
+        if aggregator:
+            closed += aggregator.flush()
+            if _agent_info:
+                for start, info, aggregates in closed:
+                    points.extend(_build_miner_points(
+                        info, aggregates, datetime.fromtimestamp(start, timezone.utc),
+                    ))
+        logger.info(
+            "Poll: %d/%d due miners answered in %.2fs, %d missing, %d cut off by the deadline; cadence %s",
+            len(found), len(due), loop.time() - started, len(missing), len(unanswered), scheduler.stats(),
+        )
+        _write_points(config, points)
+        # Miners that stopped answering may just have a new DHCP lease
+        _start_relocation(config, missing)
+    await _save_state(config)
+
 
-    return miners_to_report
+def _miner_lock(mac: str) -> asyncio.Lock:
+    """Commands run concurrently, but never two against the same miner."""
+    lock = _miner_locks.get(mac)
+    if lock is None:
+        lock = _miner_locks[mac] = asyncio.Lock()
+    return lock
 
 
-async def handle_command(cmd: dict) -> dict | None:
-    """Handle command from server. Returns response to send."""
+async def _rescan(command_id, send) -> dict:
+    """Run a scan, streaming discovered miners as batched scan_progress messages."""
+    config = get_config()
+    if send is None:
+        miners, stats = await _discover(config)
+        return {"type": "scan_result", "command_id": command_id, "discovered": miners, "scan_stats": stats}
+
+    pending: list[dict] = []
+    found_event = asyncio.Event()
+    finished = asyncio.Event()
+
+    def on_found(miner: dict):
+        pending.append(miner)
+        found_event.set()
+
+    async def stream_progress():
+        # Runs until the scan has finished and what was left is sent, so a batch is never cut off mid-send
+        while True:
+            await found_event.wait()
+            found_event.clear()
+            if pending:
+                batch = pending[:]
+                del pending[:len(batch)]
+                try:
+                    await send({"type": "scan_progress", "command_id": command_id, "miners": batch})
+                except Exception as e:
+                    logger.warning("Rescan: could not stream progress: %s", e)
+                    return
+            if finished.is_set():
+                return
+            with suppress(asyncio.TimeoutError):
+                await asyncio.wait_for(finished.wait(), timeout=SCAN_PROGRESS_INTERVAL)
+
+    streamer = asyncio.create_task(stream_progress())
+    try:
+        miners, stats = await _discover(config, on_found)
+    finally:
+        finished.set()
+        found_event.set()
+        await streamer
+    return {"type": "scan_result", "command_id": command_id, "discovered": miners, "scan_stats": stats}
+
+
+async def _bulk(cmd: dict, send) -> dict:
+    """
+    Run one action on many miners: at most `concurrency` at a time, starts
+    spaced `stagger` seconds apart (e.g. so a restart wave does not trip the
+    breakers). Per-miner results stream back as batched "running"
+    command_result messages; the final "completed" one carries the rest
+    plus totals.
+    """
+    command_id = cmd.get("command_id")
+    action = cmd.get("action")
+    miners = [m for m in cmd.get("miners") or [] if m.get("mac")]
+    if action not in BULK_ACTIONS:
+        return {"type": "command_result", "command_id": command_id, "status": "failed", "result": {"error": f"unsupported bulk action {action!r}"}}
+    concurrency = max(1, min(int(cmd.get("concurrency") or 16), BULK_MAX_CONCURRENCY))
+    stagger = max(0.0, float(cmd.get("stagger") or 0))
+    params = {k: cmd[k] for k in ("worker1", "worker2", "worker3") if k in cmd}
+
+    pending: list[dict] = []
+    counts = {"ok": 0, "failed": 0}
+    ready = asyncio.Event()  # a full batch is waiting
+    finished = asyncio.Event()
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def run_one(i: int, miner: dict):
+        await asyncio.sleep(i * stagger)
+        async with semaphore:
+            # No full sweep per miner: a bulk over a rack that moved would start one sweep each
+            sub = {
+                "type": action, "command_id": None, "miner_mac": miner["mac"], "password": miner.get("password"),
+                "full_sweep": False, **params,
+            }
+            try:
+                res = await handle_command(sub)
+            except Exception as e:
+                res = {"status": "failed", "result": {"error": str(e)}}
+        status = (res or {}).get("status", "failed")
+        counts["ok" if status == "completed" else "failed"] += 1
+        pending.append({"mac": miner["mac"], "status": status, "result": (res or {}).get("result")})
+        if len(pending) >= BULK_RESULT_BATCH:
+            ready.set()
+
+    async def stream_results():
+        # A batch leaves `pending` only once sent; whatever is left goes in the final message
+        while not finished.is_set():
+            tick = False
+            try:
+                await asyncio.wait_for(ready.wait(), timeout=BULK_RESULT_INTERVAL)
+            except asyncio.TimeoutError:
+                tick = True
+            ready.clear()
+            # Full batches as soon as they fill up, a partial one once per interval
+            while pending and not finished.is_set() and (tick or len(pending) >= BULK_RESULT_BATCH):
+                batch = pending[:BULK_RESULT_BATCH]
+                try:
+                    await send({"type": "command_result", "command_id": command_id, "status": "running", "result": {"results": batch}})
+                except Exception as e:
+                    logger.warning("Bulk %s: could not stream results: %s", action, e)
+                    return
+                del pending[:len(batch)]
+
+    started = time.monotonic()
+    streamer = asyncio.create_task(stream_results()) if send is not None else None
+    try:
+        await asyncio.gather(*(run_one(i, m) for i, m in enumerate(miners)))
+    finally:
+        finished.set()
+        ready.set()
+        if streamer is not None:
+            await streamer
+    logger.info("Bulk %s: %d ok, %d failed in %.1fs", action, counts["ok"], counts["failed"], time.monotonic() - started)
+    return {
+        "type": "command_result",
+        "command_id": command_id,
+        "status": "completed",
+        "result": {"results": pending, "total": len(miners), **counts, "duration_s": round(time.monotonic() - started, 1)},
+    }
+
+
+async def handle_command(cmd: dict, send=None) -> dict | None:
+    """
+    Handle command from server. Returns response to send.
+    send(msg) is an optional coroutine for intermediate messages (e.g. scan_progress).
+    Each command runs in its own task, so this may be called again while a
+    previous command (a long rescan, say) is still running.
+    """
     cmd_type = cmd.get("type")
     command_id = cmd.get("command_id")
 
     if cmd_type == "rescan":
-        config = get_config()
-        miners = await collect_metrics_and_send(config)
-        return {"type": "scan_result", "command_id": command_id, "discovered": miners}
+        return await _rescan(command_id, send)
+
+    if cmd_type == "bulk":
+        return await _bulk(cmd, send)
 
     if cmd_type in ("restart", "power_off", "power_on"):
         miner_mac = cmd.get("miner_mac")
@@ -97,19 +592,20 @@ async def handle_command(cmd: dict) -> dict | None:
         if not miner_mac:
             return {"type": "command_result", "command_id": command_id, "status": "failed", "result": {"error": "no mac"}}
 
-        miner = _miners_cache.get(miner_mac)
-        if not miner:
-            return {"type": "command_result", "command_id": command_id, "status": "failed", "result": {"error": "miner not in cache"}}
-
-        ip = miner.get("ip")
-        if not ip:
-            return {"type": "command_result", "command_id": command_id, "status": "failed", "result": {"error": "no ip"}}
+        # Password may be empty for some miners
+        if not (password or cmd_type == "restart"):
+            return {"type": "command_result", "command_id": command_id, "status": "completed", "result": {}}
 
+        config = get_config()
         api_cmd = "restart_btminer" if cmd_type == "restart" else cmd_type
-        # Password may be empty for some miners
-        result = exec_command(ip, password or "admin", api_cmd) if password or cmd_type == "restart" else None
-        if result is None and (password or cmd_type == "restart"):
-            return {"type": "command_result", "command_id": command_id, "status": "failed", "result": {"error": "exec failed"}}
+
+        async def run(ip):
+            return await exec_command(ip, password or "admin", api_cmd, port=config["WHATSMINER_PORT"])
+
+        async with _miner_lock(miner_mac):
+            result, error = await _exec_on_miner(miner_mac, config, run, cmd.get("full_sweep", True))
+        if error:
+            return {"type": "command_result", "command_id": command_id, "status": "failed", "result": {"error": error}}
         return {"type": "command_result", "command_id": command_id, "status": "completed", "result": result or {}}
 
     if cmd_type == "update_worker":
@@ -118,35 +614,73 @@ async def handle_command(cmd: dict) -> dict | None:
         worker1 = cmd.get("worker1", "")
         worker2 = cmd.get("worker2", "")
         worker3 = cmd.get("worker3", "")
-        miner = _miners_cache.get(miner_mac)
-        if not miner:
-            return {"type": "command_result", "command_id": command_id, "status": "failed", "result": {"error": "miner not in cache"}}
-        from miner_client import update_pools
+        config = get_config()
+
+        async def run(ip):
+            return await update_pools(ip, password or "admin", worker1, worker2, worker3, config["WHATSMINER_PORT"])
 
-        result = update_pools(miner["ip"], password or "admin", worker1, worker2, worker3)
+        async with _miner_lock(miner_mac):
+            result, error = await _exec_on_miner(miner_mac, config, run, cmd.get("full_sweep", True))
+        if error:
+            return {"type": "command_result", "command_id": command_id, "status": "failed", "result": {"error": error}}
+        _static_info.invalidate(miner_mac)  # pick up the new pool URLs on the next poll
         return {"type": "command_result", "command_id": command_id, "status": "completed", "result": result or {}}
 
     if cmd_type == "get_realtime":
         miner_mac = cmd.get("miner_mac")
-        miner = _miners_cache.get(miner_mac)
-        if not miner:
-            return {"type": "command_result", "command_id": command_id, "status": "failed", "result": {"error": "miner not in cache"}}
-        ip = miner.get("ip")
-        summary = get_summary(ip) if ip else None
-        info = extract_miner_info(summary) if summary else None
-        return {"type": "command_result", "command_id": command_id, "status": "completed", "result": info or {}}
+        config = get_config()
+        # Latest poll from memory if recent enough (max_age seconds, default the slowest poll cadence)
+        sample = _get_history(config).latest(miner_mac) if miner_mac else None
+        miner = _miners_cache.get(miner_mac) if miner_mac else None
+        max_age = float(cmd.get("max_age") or config["POLL_MAX_INTERVAL"])
+        if sample and miner and time.time() - sample["ts"] <= max_age:
+            # The inventory holds the full info from the same poll (boards, pools, static details)
+            result = {**miner, "sampled_at": sample["ts"], "age_s": round(time.time() - sample["ts"], 1)}
+            return {"type": "command_result", "command_id": command_id, "status": "completed", "result": result}
+        # Otherwise resolving the miner fetches a fresh summary on its verified address
+        # (no full sweep: a dashboard read should not scan the range; the poll re-locates it)
+        info = None
+        if miner_mac:
+            async with _miner_lock(miner_mac):
+                info = await _resolve_miner(miner_mac, config, full_sweep=False)
+        if not info:
+            return {"type": "command_result", "command_id": command_id, "status": "failed", "result": {"error": "miner not found"}}
+        return {"type": "command_result", "command_id": command_id, "status": "completed", "result": info}
+
+    if cmd_type == "get_history":
+        miner_mac = cmd.get("miner_mac")
+        samples = _get_history(get_config()).recent(miner_mac, cmd.get("seconds")) if miner_mac else None
+        if samples is None:
+            return {"type": "command_result", "command_id": command_id, "status": "failed", "result": {"error": "no history for miner"}}
+        return {"type": "command_result", "command_id": command_id, "status": "completed", "result": samples}
 
     return None
 
 
-async def metrics_loop(config: dict):
-    """Every 2 minutes: collect and send metrics."""
+async def run_periodic(name: str, interval: float, jitter: float, fn, *args) -> None:
+    """
+    Run fn(*args) every interval seconds. Each run has a hard deadline of one
+    interval, so runs never overlap; a run that hits it is cancelled and logged,
+    and missed ticks are skipped rather than run back to back. Start time and
+    every tick are jittered by +/- jitter * interval so farms do not align.
+    """
+    loop = asyncio.get_running_loop()
+    await asyncio.sleep(random.uniform(0, interval * jitter))
+    next_at = loop.time()
     while True:
         try:
-            await collect_metrics_and_send(config)
+            await asyncio.wait_for(fn(*args), timeout=interval)
+        except asyncio.TimeoutError:
+            logger.warning("%s run exceeded its %.0fs deadline; cancelled", name, interval)
         except Exception as e:
-            logger.exception("Metrics loop error: %s", e)
-        await asyncio.sleep(120)
+            logger.exception("%s loop error: %s", name, e)
+        next_at += interval
+        now = loop.time()
+        if now > next_at:
+            skipped = int((now - next_at) // interval) + 1
+            logger.warning("%s overran by %.1fs; skipping %d run(s)", name, now - next_at, skipped)
+            next_at += skipped * interval
+        await asyncio.sleep(max(0.0, next_at - now + random.uniform(-jitter, jitter) * interval))
 
 
 async def fetch_agent_info(config: dict):
@@ -164,6 +698,8 @@ async def fetch_agent_info(config: dict):
                         "agent_id": str(data.get("agent_id", "")),
                     })
                     logger.info("Agent info: farm=%s", _agent_info.get("farm_name"))
+                    if _state is not None:
+                        await asyncio.to_thread(_state.save_identity, config["AGENT_TOKEN"], dict(_agent_info))
     except Exception as e:
         logger.warning("Could not fetch agent info: %s", e)
 
@@ -174,22 +710,75 @@ async def main():
         logger.error("AGENT_TOKEN not set")
         sys.exit(1)
 
-    # Fetch agent info for InfluxDB tags
-    await fetch_agent_info(config)
-
-    # Start metrics loop in background
-    asyncio.create_task(metrics_loop(config))
+    # Warm start: the previous run's miners answer commands right away (each
+    # address is re-verified before use) while polls and discovery revalidate
+    _restore_state(config)
+
+    # Fetch agent info for InfluxDB tags; with a saved copy, refresh it in the background
+    identity_refresh = None
+    if _agent_info:
+        identity_refresh = asyncio.create_task(fetch_agent_info(config))
+    else:
+        await fetch_agent_info(config)
+
+    global _influx_writer
+    # With METRICS_SINK=server batches go over the WebSocket and the server
+    # writes them to InfluxDB, so this Pi needs no InfluxDB token
+    to_server = config["METRICS_SINK"] == "server"
+    if to_server or config["INFLUXDB_TOKEN"]:
+        _influx_writer = InfluxWriter(
+            config["INFLUXDB_URL"],
+            config["INFLUXDB_TOKEN"],
+            config["INFLUXDB_ORG"],
+            config["INFLUXDB_BUCKET"],
+            batch_size=config["INFLUX_BATCH_SIZE"],
+            flush_interval=config["INFLUX_FLUSH_INTERVAL"],
+            max_queue=config["INFLUX_MAX_QUEUE"],
+            spool=Spool(config["SPOOL_DIR"], int(config["SPOOL_MAX_MB"] * (1 << 20))) if config["SPOOL_DIR"] else None,
+            replay_rate=config["SPOOL_REPLAY_RATE"],
+            tag_schema=config["TAG_SCHEMA"],
+            transport=send_metrics if to_server else None,
+        )
+        _influx_writer.start()
+
+    # systemd stops the agent with SIGTERM; unwind through the finally below so queued points are flushed
+    main_task = asyncio.current_task()
+    asyncio.get_running_loop().add_signal_handler(signal.SIGTERM, main_task.cancel)
+
+    # Slow LAN discovery and fast metrics polling run on separate schedules
+    background = [
+        asyncio.create_task(run_periodic(
+            "Discovery", config["DISCOVERY_INTERVAL"], config["SCHEDULE_JITTER"], run_discovery, config,
+        )),
+        asyncio.create_task(run_periodic(
+            "Poll", config["POLL_INTERVAL"], config["SCHEDULE_JITTER"], poll_known_miners, config,
+        )),
+    ]
 
     # WebSocket to server
-    async def on_cmd(cmd):
-        return await handle_command(cmd)
+    async def on_cmd(cmd, send):
+        return await handle_command(cmd, send)
 
-    await run_websocket(
-        config["SERVER_URL"],
-        config["AGENT_TOKEN"],
-        on_command=on_cmd,
-    )
+    try:
+        await run_websocket(
+            config["SERVER_URL"],
+            config["AGENT_TOKEN"],
+            on_command=on_cmd,
+            codec=config["WS_CODEC"],
+            compression=config["WS_COMPRESSION"],
+        )
+    finally:
+        for task in [*background, identity_refresh, _relocation_task]:
+            if task:
+                task.cancel()
+        if _state is not None:
+            await _save_state(config, scan=True)
+            _state.close()
+        if _influx_writer:
+            await _influx_writer.close()
+            logger.info("InfluxDB writer closed: %s", _influx_writer.status())
 
 
 if __name__ == "__main__":
-    asyncio.run(main())
+    with suppress(asyncio.CancelledError, KeyboardInterrupt):
+        asyncio.run(main())
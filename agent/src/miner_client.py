@@ -1,26 +1,93 @@
-"""WhatsMiner API client - read-only (summary) and optional write (with password)."""
+"""WhatsMiner API client (asyncio) - read-only queries and optional write commands (with password)."""
+import asyncio
+import base64
+import hashlib
+import json
 import logging
-from typing import Any
+import time
+from contextlib import suppress
+from typing import Any, AsyncIterator, Iterable
 
 logger = logging.getLogger(__name__)
 
+DEFAULT_PORT = 4028
+REQUEST_TIMEOUT = 5.0  # connect + request + full reply, per API call
+MAX_RESPONSE_BYTES = 1 << 20
+STATIC_REFRESH = 3600.0  # seconds between re-reads of firmware / PSU details
+TOKEN_TTL = 30 * 60 - 60  # firmware tokens expire after 30 minutes; renew a minute early
+TOKEN_ERROR_CODES = (135, 136)  # "check token error", "token over max times": the write was not run
 
-def get_summary(ip: str, port: int = 4028) -> dict | None:
-    """
-    Get WhatsMiner summary (read-only, no password).
-    Returns dict with MAC, IP, Model, hashrate, temperature, etc. or None on error.
-    """
+_ITOA64 = "./0123456789ABCDEFGHIJKLMNOPQRSTUVWXYZabcdefghijklmnopqrstuvwxyz"
+
+
+class WhatsMinerError(Exception):
+    """Miner replied with an error or an unusable response."""
+
+
+class _TokenRejected(WhatsMinerError):
+    """Miner refused the write token itself; the command did not run."""
+
+
+def parse_api_response(data: bytes) -> dict | None:
+    """Decode a WhatsMiner API reply (JSON, sometimes NUL-terminated)."""
     try:
-        from whatsminer import WhatsminerAccessToken, WhatsminerAPI
+        parsed = json.loads(data.rstrip(b"\x00 \r\n").decode("utf-8", errors="replace"))
+        return parsed if isinstance(parsed, dict) else None
+    except ValueError:
+        return None
 
-        token = WhatsminerAccessToken(ip_address=ip, port=port)
-        result = WhatsminerAPI.get_read_only_info(token, "summary")
-        return result
+
+async def _request(ip: str, port: int, payload: dict, timeout: float) -> dict:
+    """Send one API request; the miner replies once and closes the connection."""
+
+    async def exchange() -> bytes:
+        reader, writer = await asyncio.open_connection(ip, port)
+        try:
+            writer.write(json.dumps(payload).encode())
+            await writer.drain()
+            chunks, size = [], 0
+            while size < MAX_RESPONSE_BYTES:
+                chunk = await reader.read(65536)
+                if not chunk:
+                    break
+                chunks.append(chunk)
+                size += len(chunk)
+            return b"".join(chunks)
+        finally:
+            writer.close()
+            with suppress(Exception):
+                await writer.wait_closed()
+
+    data = await asyncio.wait_for(exchange(), timeout=timeout)
+    reply = parse_api_response(data)
+    if reply is None:
+        raise WhatsMinerError(f"invalid response: {data[:200]!r}")
+    return reply
+
+
+async def get_read_only_info(
+    ip: str,
+    cmd: str,
+    params: dict | None = None,
+    port: int = DEFAULT_PORT,
+    timeout: float = REQUEST_TIMEOUT,
+) -> dict | None:
+    """Read-only API command (summary, devs, pools, ...). Returns the reply or None on error."""
+    try:
+        return await _request(ip, port, {"cmd": cmd, **(params or {})}, timeout)
     except Exception as e:
-        logger.warning("WhatsMiner summary %s:%s failed: %s", ip, port, e)
+        logger.warning("WhatsMiner %s %s:%s failed: %s", cmd, ip, port, e or type(e).__name__)
         return None
 
 
+async def get_summary(ip: str, port: int = DEFAULT_PORT, timeout: float = REQUEST_TIMEOUT) -> dict | None:
+    """
+    Get WhatsMiner summary (read-only, no password).
+    Returns dict with MAC, IP, Model, hashrate, temperature, etc. or None on error.
+    """
+    return await get_read_only_info(ip, "summary", port=port, timeout=timeout)
+
+
 def extract_miner_info(summary: dict) -> dict | None:
     """
     Extract mac, ip, model from WhatsMiner summary response.
@@ -51,26 +118,358 @@ def extract_miner_info(summary: dict) -> dict | None:
         return None
 
 
-def exec_command(ip: str, password: str, cmd: str, params: dict | None = None, port: int = 4028) -> dict | None:
+def _number(value) -> float | None:
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return None
+
+
+def _msg(reply) -> dict:
+    """Msg payload of get_* commands, {} if the call failed or returned an error."""
+    if isinstance(reply, dict) and reply.get("STATUS") != "E" and isinstance(reply.get("Msg"), dict):
+        return reply["Msg"]
+    return {}
+
+
+def extract_summary_extras(summary: dict) -> dict:
+    """Power, fan and chip readings from the summary row (None where the firmware does not report them)."""
+    row = (summary.get("SUMMARY") or [{}])[0]
+    return {
+        "power": _number(row.get("Power")),
+        "power_limit": _number(row.get("Power Limit")),
+        "power_rate": _number(row.get("Power Rate")),
+        "fan_in": _number(row.get("Fan Speed In")),
+        "fan_out": _number(row.get("Fan Speed Out")),
+        "env_temperature": _number(row.get("Env Temp")),
+        "chip_temp_max": _number(row.get("Chip Temp Max")),
+        "freq_avg": _number(row.get("freq_avg")),
+        "uptime": _number(row.get("Uptime")),
+    }
+
+
+def extract_boards(edevs: dict) -> list[dict]:
+    """Per-hashboard readings from edevs/devs (hashrate in GH/s like the summary)."""
+    boards = []
+    for row in edevs.get("DEVS") or []:
+        if not isinstance(row, dict):
+            continue
+        mhs = _number(row.get("MHS 5s"))
+        boards.append({
+            "board": str(row.get("Slot", row.get("ASC", len(boards)))),
+            "hashrate": mhs / 1000 if mhs is not None else None,
+            "temperature": _number(row.get("Temperature")),
+            "chip_temp_min": _number(row.get("Chip Temp Min")),
+            "chip_temp_max": _number(row.get("Chip Temp Max")),
+            "chip_temp_avg": _number(row.get("Chip Temp Avg")),
+            "frequency": _number(row.get("Chip Frequency")),
+            "effective_chips": _number(row.get("Effective Chips")),
+            "alive": 1 if str(row.get("Status", "")).lower() == "alive" else 0,
+        })
+    return boards
+
+
+def extract_pools(pools: dict) -> tuple[list[dict], dict]:
+    """(pool list for display, numeric pool status fields)."""
+    rows = [row for row in pools.get("POOLS") or [] if isinstance(row, dict)]
+    listing = [
+        {"url": row.get("URL"), "user": row.get("User"), "status": row.get("Status")}
+        for row in rows
+    ]
+    active = next((row for row in rows if row.get("Stratum Active") in (True, "true")), None)
+    fields = {
+        "pools_alive": sum(1 for row in rows if row.get("Status") == "Alive"),
+        "pool_active": _number(active.get("POOL")) if active else None,
+        "pool_rejected": _number(active.get("Rejected")) if active else None,
+        "pool_stale": _number(active.get("Stale")) if active else None,
+    }
+    return listing, {**fields, "worker": active.get("User") if active else None}
+
+
+def extract_error_codes(reply: dict) -> list[str]:
+    codes = []
+    for entry in _msg(reply).get("error_code") or []:
+        codes.extend(entry if isinstance(entry, dict) else [entry])
+    return [str(code) for code in codes]
+
+
+class StaticInfoCache:
+    """
+    Rarely changing miner details (firmware, PSU, pool URLs) keyed by MAC.
+    Re-read every `refresh` seconds, or sooner if the miner rebooted (uptime
+    went backwards), since that is when firmware and pools change.
+    """
+
+    def __init__(self, refresh: float = STATIC_REFRESH):
+        self.refresh = refresh
+        self._entries: dict[str, tuple[float, float, dict]] = {}  # mac -> (fetched at, elapsed, info)
+
+    def get(self, mac: str, elapsed) -> dict | None:
+        entry = self._entries.get(mac)
+        if not entry:
+            return None
+        fetched_at, last_elapsed, info = entry
+        elapsed = _number(elapsed)
+        if time.monotonic() - fetched_at > self.refresh or (elapsed is not None and elapsed < last_elapsed):
+            return None
+        self._entries[mac] = (fetched_at, elapsed if elapsed is not None else last_elapsed, info)
+        return info
+
+    def put(self, mac: str, elapsed, info: dict) -> None:
+        self._entries[mac] = (time.monotonic(), _number(elapsed) or 0.0, info)
+
+    def invalidate(self, mac: str) -> None:
+        """Re-read on the next poll (e.g. after the pools were changed)."""
+        self._entries.pop(mac, None)
+
+
+async def _try_request(ip: str, port: int, cmd: str, timeout: float) -> dict | None:
+    """Optional endpoint: older firmware may not have it, so failures are not logged."""
+    try:
+        return await _request(ip, port, {"cmd": cmd}, timeout)
+    except Exception:
+        return None
+
+
+async def get_telemetry(
+    ip: str,
+    port: int = DEFAULT_PORT,
+    timeout: float = REQUEST_TIMEOUT,
+    static: StaticInfoCache | None = None,
+) -> dict | None:
+    """
+    One collection pass: summary, edevs (per board), pools and error codes in
+    parallel, plus firmware/PSU details when the static cache has none.
+    Returns extract_miner_info() extended with power/fan fields, "boards",
+    "pools", "error_codes" and the static details, or None if summary failed.
+    """
+    summary, edevs, pools, errors = await asyncio.gather(
+        get_summary(ip, port, timeout),
+        _try_request(ip, port, "edevs", timeout),
+        _try_request(ip, port, "pools", timeout),
+        _try_request(ip, port, "get_error_code", timeout),
+    )
+    info = extract_miner_info(summary) if summary else None
+    if not info:
+        return None
+    info.update({k: v for k, v in extract_summary_extras(summary).items() if v is not None})
+    info["boards"] = extract_boards(edevs) if edevs else []
+    pool_list, pool_fields = extract_pools(pools) if pools else ([], {})
+    info.update({k: v for k, v in pool_fields.items() if v is not None})
+    info["error_codes"] = extract_error_codes(errors) if errors else []
+
+    details = static.get(info["mac"], info.get("elapsed")) if static else None
+    if details is None:
+        version, psu = await asyncio.gather(
+            _try_request(ip, port, "get_version", timeout),
+            _try_request(ip, port, "get_psu", timeout),
+        )
+        version, psu = _msg(version), _msg(psu)
+        details = {
+            "firmware": version.get("fw_ver"),
+            "platform": version.get("platform"),
+            "psu_model": psu.get("model"),
+            "psu_firmware": psu.get("sw_version"),
+            "pools": pool_list,
+        }
+        if static:
+            static.put(info["mac"], info.get("elapsed"), details)
+    info.update(details)
+    return info
+
+
+async def poll_miners(
+    ips: Iterable[str],
+    port: int = DEFAULT_PORT,
+    concurrency: int = 64,
+    timeout: float = REQUEST_TIMEOUT,
+    static: StaticInfoCache | None = None,
+    deadline: float | None = None,
+) -> AsyncIterator[tuple[str, dict | None]]:
+    """
+    Collect telemetry (see get_telemetry) with at most `concurrency` miners in
+    flight; timeout is the per-miner deadline, covering both request rounds
+    (a miner that runs out of it yields None). Yields (ip, miner info or None)
+    in completion order, so slow or dead miners never hold up the rest.
+    After `deadline` seconds the whole pass stops: miners not done by then are
+    cancelled and not yielded.
+    """
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def poll(ip: str) -> tuple[str, dict | None]:
+        async with semaphore:
+            try:
+                info = await asyncio.wait_for(get_telemetry(ip, port, timeout, static), timeout)
+            except asyncio.TimeoutError:
+                logger.debug("WhatsMiner poll of %s exceeded its %.1fs deadline", ip, timeout)
+                info = None
+        if info:
+            info["ip"] = ip  # the address we reached, not what the firmware reports
+        return ip, info
+
+    tasks = [asyncio.ensure_future(poll(ip)) for ip in ips]
+    try:
+        for next_done in asyncio.as_completed(tasks, timeout=deadline):
+            try:
+                yield await next_done
+            except asyncio.TimeoutError:
+                return
+    finally:
+        for task in tasks:
+            task.cancel()
+
+
+def _md5_crypt(password: str, salt: str) -> str:
+    """Hash part of an MD5-crypt ($1$salt$hash) digest, as the firmware computes it."""
+    pw, salt_b = password.encode(), salt.encode()[:8]
+    alt = hashlib.md5(pw + salt_b + pw).digest()
+    ctx = pw + b"$1$" + salt_b + (alt * (len(pw) // 16 + 1))[:len(pw)]
+    i = len(pw)
+    while i:
+        ctx += b"\x00" if i & 1 else pw[:1]
+        i >>= 1
+    final = hashlib.md5(ctx).digest()
+    for i in range(1000):
+        round_ = (pw if i & 1 else final) + (salt_b if i % 3 else b"") + (pw if i % 7 else b"")
+        final = hashlib.md5(round_ + (final if i & 1 else pw)).digest()
+
+    out = []
+    for a, b, c in ((0, 6, 12), (1, 7, 13), (2, 8, 14), (3, 9, 15), (4, 10, 5)):
+        v = final[a] << 16 | final[b] << 8 | final[c]
+        out.extend(_ITOA64[(v >> (6 * k)) & 0x3F] for k in range(4))
+    v = final[11]
+    out.extend(_ITOA64[(v >> (6 * k)) & 0x3F] for k in range(2))
+    return "".join(out)
+
+
+class _WriteToken:
+    """Sign and AES key for encrypted write commands, derived from get_token and the admin password."""
+
+    def __init__(self, token_info: dict, password: str):
+        from Crypto.Cipher import AES
+
+        key = _md5_crypt(password, token_info["salt"])
+        self.sign = _md5_crypt(key + token_info["time"], token_info["newsalt"])
+        self._aes_key = hashlib.sha256(key.encode()).digest()
+        self._aes = AES
+
+    def encrypt(self, payload: dict) -> str:
+        plain = json.dumps(payload).encode()
+        plain += b"\x00" * (-len(plain) % 16)
+        return base64.b64encode(self._aes.new(self._aes_key, self._aes.MODE_ECB).encrypt(plain)).decode()
+
+    def decrypt(self, data: str) -> dict:
+        plain = self._aes.new(self._aes_key, self._aes.MODE_ECB).decrypt(base64.b64decode(data))
+        return json.loads(plain.split(b"\x00")[0].decode())
+
+
+async def _get_write_token(ip: str, port: int, password: str, timeout: float) -> _WriteToken:
+    reply = await _request(ip, port, {"cmd": "get_token"}, timeout)
+    token_info = reply.get("Msg")
+    if not isinstance(token_info, dict):
+        raise WhatsMinerError(f"get_token: {token_info}")  # e.g. "over max connect"
+    return _WriteToken(token_info, password)
+
+
+class _TokenCache:
+    """
+    Write tokens per miner address, reused until shortly before the firmware
+    expires them. An entry only matches the password it was derived from, so a
+    password change (or a new miner taking over the address) fetches a new one.
+    """
+
+    def __init__(self, ttl: float = TOKEN_TTL):
+        self.ttl = ttl
+        self._tokens: dict[tuple[str, int], tuple[str, _WriteToken, float]] = {}
+        self._locks: dict[tuple[str, int], asyncio.Lock] = {}
+
+    async def get(self, ip: str, port: int, password: str, timeout: float) -> tuple[_WriteToken, bool]:
+        """(token, cached) - one handshake per miner even when many commands race for it."""
+        key = (ip, port)
+        lock = self._locks.setdefault(key, asyncio.Lock())
+        async with lock:
+            entry = self._tokens.get(key)
+            loop = asyncio.get_running_loop()
+            if entry and entry[0] == password and entry[2] > loop.time():
+                return entry[1], True
+            token = await _get_write_token(ip, port, password, timeout)
+            self._tokens[key] = (password, token, loop.time() + self.ttl)
+            return token, False
+
+    def invalidate(self, ip: str, port: int, token: _WriteToken | None = None) -> None:
+        """Drop the miner's token (only if it is still `token`, when given); its lock stays."""
+        entry = self._tokens.get((ip, port))
+        if entry and (token is None or entry[1] is token):
+            del self._tokens[(ip, port)]
+
+
+_token_cache = _TokenCache()
+
+
+async def _exec_with_token(
+    ip: str,
+    port: int,
+    token: _WriteToken,
+    cmd: str,
+    params: dict,
+    timeout: float,
+) -> dict:
+    reply = await _request(ip, port, {"enc": 1, "data": token.encrypt({"cmd": cmd, "token": token.sign, **params})}, timeout)
+    if reply.get("STATUS") == "E":
+        with suppress(TypeError, ValueError):
+            if int(reply.get("Code")) in TOKEN_ERROR_CODES:
+                raise _TokenRejected(reply.get("Msg") or "token rejected")
+        raise WhatsMinerError(reply.get("Msg") or "error")
+    if "enc" not in reply:
+        return reply
+    return token.decrypt(reply["enc"])
+
+
+async def exec_command(
+    ip: str,
+    password: str,
+    cmd: str,
+    params: dict | None = None,
+    port: int = DEFAULT_PORT,
+    timeout: float = REQUEST_TIMEOUT,
+) -> dict | None:
     """
     Execute writable command (restart_btminer, power_off, power_on, update_pools).
-    Requires admin password.
+    Requires admin password. The miner's write token is cached and reused; if the
+    miner rejects a cached token (expired early, miner rebooted, password changed
+    on the miner) it is dropped and the command retried once with a fresh one.
+    Writes are not idempotent, so no other failure is retried.
     """
+    additional = dict(params or {})
+    if cmd in ("power_off", "power_on", "restart_btminer"):
+        additional["respbefore"] = "true"
     try:
-        from whatsminer import WhatsminerAccessToken, WhatsminerAPI
-
-        token = WhatsminerAccessToken(ip_address=ip, port=port, admin_password=password)
-        additional = params or {}
-        if cmd in ("power_off", "power_on", "restart_btminer"):
-            additional["respbefore"] = "true"
-        result = WhatsminerAPI.exec_command(token, cmd, additional_params=additional)
-        return result
+        token, cached = await _token_cache.get(ip, port, password, timeout)
+        try:
+            return await _exec_with_token(ip, port, token, cmd, additional, timeout)
+        except _TokenRejected:
+            _token_cache.invalidate(ip, port, token)
+            if not cached:
+                raise
+        except ValueError:
+            # A reply we cannot decrypt: the command may have run, but the token is suspect
+            _token_cache.invalidate(ip, port, token)
+            raise
+        token, _ = await _token_cache.get(ip, port, password, timeout)
+        return await _exec_with_token(ip, port, token, cmd, additional, timeout)
     except Exception as e:
-        logger.warning("WhatsMiner exec %s on %s failed: %s", cmd, ip, e)
+        logger.warning("WhatsMiner exec %s on %s failed: %s", cmd, ip, e or type(e).__name__)
         return None
 
 
-def update_pools(ip: str, password: str, worker1: str = "", worker2: str = "", worker3: str = "", port: int = 4028) -> dict | None:
+async def update_pools(
+    ip: str,
+    password: str,
+    worker1: str = "",
+    worker2: str = "",
+    worker3: str = "",
+    port: int = DEFAULT_PORT,
+) -> dict | None:
     """Update pool workers. Pass empty string to leave pool unchanged."""
     params = {}
     if worker1:
@@ -79,4 +478,4 @@ def update_pools(ip: str, password: str, worker1: str = "", worker2: str = "", w
         params["worker2"] = worker2
     if worker3:
         params["worker3"] = worker3
-    return exec_command(ip, password, "update_pools", params, port) if params else {"status": "ok"}
+    return await exec_command(ip, password, "update_pools", params, port) if params else {"status": "ok"}
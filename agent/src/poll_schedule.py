@@ -0,0 +1,106 @@
+"""Per-miner poll cadence: changing or unhealthy miners are polled often, steady ones back off, within a budget."""
+import time
+
+DEFAULT_MIN_INTERVAL = 15.0
+DEFAULT_MAX_INTERVAL = 300.0
+DEFAULT_BUDGET = 600.0  # polls per minute across all miners
+
+BACKOFF_FACTOR = 1.5  # steady miner: next interval = previous * factor, up to the max
+HASHRATE_CHANGE = 0.05  # relative change in hashrate that counts as "moving"
+TEMPERATURE_CHANGE = 2.0  # degrees C between polls that counts as "moving"
+HOT_TEMPERATURE = 85.0  # at or above this a miner stays on the fast cadence
+
+
+class PollScheduler:
+    """
+    Decides which known miners to poll on each tick.
+
+    Each miner has its own interval between min_interval and max_interval. New
+    miners, hot miners, miners that just failed or recovered and miners whose
+    hashrate or temperature moved since the last poll drop back to min_interval;
+    steady miners back off geometrically, and so do miners that keep failing.
+    Polls are paid for from a token bucket refilled at budget polls per minute;
+    when more miners are due than the bucket allows, the most overdue go first
+    and the rest stay due for the next tick.
+    """
+
+    def __init__(
+        self,
+        min_interval: float = DEFAULT_MIN_INTERVAL,
+        max_interval: float = DEFAULT_MAX_INTERVAL,
+        budget: float = DEFAULT_BUDGET,
+    ):
+        self.min_interval = min_interval
+        self.max_interval = max(min_interval, max_interval)
+        self.rate = budget / 60.0  # polls per second
+        self.burst = max(1.0, self.rate * min_interval)  # at most one fast interval's worth at once
+        self.tokens = self.burst
+        self._refilled_at: float | None = None
+        # mac -> [interval, next_due, hashrate, temperature, consecutive failures]
+        self._state: dict[str, list] = {}
+
+    def due(self, macs, now: float | None = None) -> list[str]:
+        """
+        MACs to poll now, limited by the budget: answering miners before failing
+        ones (so dead miners cannot crowd out a tick), most overdue first.
+        """
+        now = now if now is not None else time.monotonic()
+        if self._refilled_at is not None:
+            self.tokens = min(self.burst, self.tokens + (now - self._refilled_at) * self.rate)
+        self._refilled_at = now
+
+        # Unknown miners are due immediately and sort first
+        due = sorted(
+            (bool(state and state[4]), state[1] if state else 0.0, mac)
+            for mac in macs
+            if not (state := self._state.get(mac)) or state[1] <= now
+        )
+        take = min(len(due), int(self.tokens))
+        self.tokens -= take
+        return [mac for _, _, mac in due[:take]]
+
+    def record(self, mac: str, info: dict | None, now: float | None = None) -> None:
+        """Update a miner's cadence from its poll result (None = poll failed)."""
+        now = now if now is not None else time.monotonic()
+        state = self._state.get(mac)
+        if info is None:
+            failures = (state[4] if state else 0) + 1
+            interval = min(self.max_interval, self.min_interval * 2 ** (failures - 1))
+            self._state[mac] = [interval, now + interval, None, None, failures]
+            return
+        if state is None or state[4] or self._moving(state, info):
+            interval = self.min_interval
+        else:
+            interval = min(self.max_interval, state[0] * BACKOFF_FACTOR)
+        self._state[mac] = [interval, now + interval, info.get("hashrate"), info.get("temperature"), 0]
+
+    def stats(self, now: float | None = None) -> dict:
+        now = now if now is not None else time.monotonic()
+        intervals = [state[0] for state in self._state.values()]
+        return {
+            "miners": len(intervals),
+            "fast": sum(1 for i in intervals if i <= self.min_interval),
+            "failing": sum(1 for state in self._state.values() if state[4]),
+            "due": sum(1 for state in self._state.values() if state[1] <= now),
+            "polls_per_min": round(sum(60.0 / i for i in intervals), 1),
+        }
+
+    @staticmethod
+    def _moving(state: list, info: dict) -> bool:
+        _, _, last_hashrate, last_temperature, _ = state
+        hashrate, temperature = _number(info.get("hashrate")), _number(info.get("temperature"))
+        last_hashrate, last_temperature = _number(last_hashrate), _number(last_temperature)
+        if temperature is not None and temperature >= HOT_TEMPERATURE:
+            return True
+        if (temperature is None) != (last_temperature is None) or (hashrate is None) != (last_hashrate is None):
+            return True  # a reading appeared or went away
+        if temperature is not None and abs(temperature - last_temperature) >= TEMPERATURE_CHANGE:
+            return True
+        return hashrate is not None and abs(hashrate - last_hashrate) > HASHRATE_CHANGE * max(abs(last_hashrate), 1.0)
+
+
+def _number(value) -> float | None:
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return None
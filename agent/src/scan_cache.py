@@ -0,0 +1,55 @@
+"""Scan result cache: known-live hosts are probed every cycle, dead addresses back off exponentially."""
+import ipaddress
+import random
+import time
+
+DEFAULT_BACKOFF_BASE = 240.0  # first miss: skip about one metrics cycle
+DEFAULT_BACKOFF_MAX = 1800.0  # longest skip; with slicing an address also waits for its slice to come round
+
+_MISS_BITS = 6  # consecutive misses are packed into the low bits of the next-probe time
+
+
+class ScanCache:
+    """
+    Positive/negative cache of probe results.
+
+    Live hosts are kept by IP string; dead hosts are kept as {ip_int: next_probe_at << 6 | misses}
+    so a half-empty /16 costs one small int pair per address, not a tuple or object.
+    """
+
+    def __init__(self, backoff_base: float = DEFAULT_BACKOFF_BASE, backoff_max: float = DEFAULT_BACKOFF_MAX):
+        self.backoff_base = backoff_base
+        self.backoff_max = max(backoff_base, backoff_max)
+        self.live: dict[str, float] = {}  # ip -> last seen (epoch seconds)
+        self.dead: dict[int, int] = {}
+
+    def live_ips(self) -> list[str]:
+        return list(self.live)
+
+    def should_probe(self, ip: str, now: float | None = None) -> bool:
+        """True for live hosts, unknown addresses and dead addresses whose backoff has expired."""
+        if ip in self.live:
+            return True
+        packed = self.dead.get(int(ipaddress.IPv4Address(ip)))
+        if packed is None:
+            return True
+        return (packed >> _MISS_BITS) <= (now if now is not None else time.time())
+
+    def record(self, ip: str, alive: bool, now: float | None = None) -> None:
+        now = now if now is not None else time.time()
+        key = int(ipaddress.IPv4Address(ip))
+        if alive:
+            self.live[ip] = now
+            self.dead.pop(key, None)
+            return
+        self.live.pop(ip, None)
+        misses = min((self.dead.get(key, 0) & ((1 << _MISS_BITS) - 1)) + 1, (1 << _MISS_BITS) - 1)
+        delay = min(self.backoff_max, self.backoff_base * 2 ** (misses - 1))
+        # Jitter spreads re-probes of a dead block over the window instead of one burst
+        next_at = int(now + delay * random.uniform(0.5, 1.0))
+        self.dead[key] = next_at << _MISS_BITS | misses
+
+    def stats(self, now: float | None = None) -> dict:
+        now = now if now is not None else time.time()
+        backing_off = sum(1 for packed in self.dead.values() if (packed >> _MISS_BITS) > now)
+        return {"live": len(self.live), "dead": len(self.dead), "backing_off": backing_off}
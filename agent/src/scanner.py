@@ -1,15 +1,54 @@
 """LAN scanner for WhatsMiner devices on port 4028."""
 import asyncio
+import bisect
+import errno
 import ipaddress
+import json
 import socket
 import logging
-from typing import Iterable
+from itertools import chain
+from typing import Callable, Iterable, Iterator
+
+from miner_client import extract_miner_info, parse_api_response
+from scan_cache import ScanCache
 
 logger = logging.getLogger(__name__)
 
 DEFAULT_PORT = 4028
-SCAN_TIMEOUT = 2.0
-MAX_CONCURRENT = 50
+SCAN_TIMEOUT = 1.0  # per-probe timeout until RTT samples are available
+MIN_PROBE_TIMEOUT = 0.25
+MAX_PROBE_TIMEOUT = 3.0
+MAX_CONCURRENT = 2048
+MIN_CONCURRENT = 8
+INITIAL_CONCURRENT = 64
+AI_STEP = 16  # additive increase per clean window once past slow start
+BACKGROUND_CONCURRENCY = 16  # slow pass over addresses without a neighbor entry
+PREWARM_WAIT = 1.0  # seconds to let ARP replies land after the pre-warm burst
+PREWARM_BURST = 256  # datagrams sent before yielding to the event loop
+LOCAL_ERROR_RETRIES = 2  # extra probes of an address whose probe failed locally (EMFILE, ENOBUFS, ...)
+PREWARM_CHUNK = 512  # addresses per chunk; the neighbor table is read after each one
+PREWARM_CHUNK_WAIT = 0.3  # seconds for a chunk's ARP replies before the table is read
+IDENTIFY_TIMEOUT = 3.0  # summary request/response on the probe connection
+MAX_RESPONSE_BYTES = 65536  # anything bigger is not a WhatsMiner summary
+SUMMARY_REQUEST = json.dumps({"cmd": "summary"}).encode()
+LOCATE_NEARBY = 16  # addresses either side of the last known IP tried when re-locating
+LOCATE_CONCURRENCY = 64
+FD_HEADROOM = 64  # sockets reserved for WebSocket, InfluxDB and miner API connections
+
+# Local errors meaning we are sending faster than the host/NIC can take
+_LOCAL_CONGESTION_ERRNOS = {errno.EMFILE, errno.ENFILE, errno.ENOBUFS, errno.EAGAIN, errno.EADDRNOTAVAIL}
+
+# Parameters picked by the last sweep (window, timeout, RTT, outcome counts)
+last_scan_stats: dict = {}
+# Learned controller state per scan spec, so each network starts where it converged last time
+_learned: dict[str, dict] = {}
+# Neighbor mode: background pass per scan spec and the hits it found since the last scan
+_background_tasks: dict[str, asyncio.Task] = {}
+_background_found: dict[str, set[str]] = {}
+# Time-sliced sweeps: next address offset per scan spec
+_slice_cursor: dict[str, int] = {}
+# (range spec, port) -> the one full-range locate sweep in flight; every locate_miner waits on it
+_locate_sweeps: dict[tuple[str, int], "_LocateSweep"] = {}
 
 
 def _get_default_scan_range() -> str:
@@ -41,73 +80,717 @@ def _get_default_scan_range() -> str:
     return "192.168.1.0/24"
 
 
-def _parse_scan_range(spec: str) -> list[str]:
-    """Parse CIDR or range spec to list of IP strings."""
+def _parse_item(item: str, hosts_only: bool) -> tuple[int, int]:
+    """Parse one CIDR, dash range or single IP to an inclusive (first, last) integer interval."""
+    if "/" in item:
+        net = ipaddress.IPv4Network(item, strict=False)
+        first, last = int(net.network_address), int(net.broadcast_address)
+        if hosts_only and net.prefixlen < 31:
+            # Same as net.hosts(): skip network and broadcast addresses
+            first, last = first + 1, last - 1
+        return first, last
+    if "-" in item:
+        # 192.168.1.1-192.168.1.50
+        start_s, end_s = item.split("-", 1)
+        return int(ipaddress.IPv4Address(start_s.strip())), int(ipaddress.IPv4Address(end_s.strip()))
+    ip = int(ipaddress.IPv4Address(item))
+    return ip, ip
+
+
+def _merge(intervals: list[tuple[int, int]]) -> list[tuple[int, int]]:
+    """Sort and coalesce overlapping or adjacent intervals."""
+    merged: list[tuple[int, int]] = []
+    for start, end in sorted(i for i in intervals if i[0] <= i[1]):
+        if merged and start <= merged[-1][1] + 1:
+            merged[-1] = (merged[-1][0], max(merged[-1][1], end))
+        else:
+            merged.append((start, end))
+    return merged
+
+
+def _subtract(include: list[tuple[int, int]], exclude: list[tuple[int, int]]) -> list[tuple[int, int]]:
+    """Remove the (sorted, disjoint) exclude intervals from the include intervals."""
+    out = []
+    for start, end in include:
+        for ex_start, ex_end in exclude:
+            if ex_end < start or ex_start > end:
+                continue
+            if ex_start > start:
+                out.append((start, ex_start - 1))
+            start = ex_end + 1
+            if start > end:
+                break
+        if start <= end:
+            out.append((start, end))
+    return out
+
+
+def _parse_intervals(spec: str) -> list[tuple[int, int]]:
+    """
+    Parse a scan spec into sorted, disjoint integer intervals.
+    Comma-separated CIDRs, dash ranges or single IPs; a "!" prefix excludes, e.g.
+    "10.0.0.0/22,10.0.8.10-10.0.8.60,!10.0.1.0/24,!10.0.0.1".
+    """
+    include, exclude = [], []
+    for raw in spec.split(","):
+        item = raw.strip()
+        if not item:
+            continue
+        try:
+            if item.startswith("!"):
+                exclude.append(_parse_item(item[1:].strip(), hosts_only=False))
+            else:
+                include.append(_parse_item(item, hosts_only=True))
+        except Exception as e:
+            logger.warning("Invalid scan range %s: %s", item, e)
+    return _subtract(_merge(include), _merge(exclude))
+
+
+def _range_size(intervals: list[tuple[int, int]]) -> int:
+    return sum(end - start + 1 for start, end in intervals)
+
+
+def _in_ranges(intervals: list[tuple[int, int]], ip: str) -> bool:
     try:
-        if "/" in spec:
-            net = ipaddress.ip_network(spec.strip(), strict=False)
-            return [str(ip) for ip in net.hosts()]
-        if "-" in spec:
-            # 192.168.1.1-192.168.1.50
-            start_s, end_s = spec.split("-", 1)
-            start_ip = ipaddress.ip_address(start_s.strip())
-            end_ip = ipaddress.ip_address(end_s.strip())
-            return [str(ipaddress.ip_address(i)) for i in range(int(start_ip), int(end_ip) + 1)]
+        n = int(ipaddress.IPv4Address(ip))
+    except ValueError:
+        return False
+    i = bisect.bisect_right(intervals, (n, 0xFFFFFFFF)) - 1
+    return i >= 0 and intervals[i][0] <= n <= intervals[i][1]
+
+
+def _iter_addresses(intervals: list[tuple[int, int]], offset: int = 0, count: int | None = None) -> Iterator[str]:
+    """Lazily yield IP strings, skipping the first offset addresses and stopping after count."""
+    remaining = count
+    for start, end in intervals:
+        size = end - start + 1
+        if offset >= size:
+            offset -= size
+            continue
+        first = start + offset
+        stop = end + 1 if remaining is None else min(end + 1, first + remaining)
+        for n in range(first, stop):
+            yield socket.inet_ntoa(n.to_bytes(4, "big"))
+        if remaining is not None:
+            remaining -= stop - first
+            if remaining <= 0:
+                return
+        offset = 0
+
+
+def _parse_scan_range(spec: str) -> Iterator[str]:
+    """Parse a scan spec (see _parse_intervals) to a lazy generator of IP strings."""
+    return _iter_addresses(_parse_intervals(spec))
+
+
+def read_neighbor_table() -> dict[str, str]:
+    """
+    Resolved IPv4 neighbors from the kernel: {ip: mac}.
+    Reads /proc/net/arp, falling back to `ip -4 neigh show`.
+    """
+    neighbors: dict[str, str] = {}
+    try:
+        with open("/proc/net/arp") as f:
+            next(f, None)  # header
+            for line in f:
+                parts = line.split()
+                # IP address, HW type, Flags, HW address, Mask, Device
+                if len(parts) < 4:
+                    continue
+                flags = int(parts[2], 16)
+                if flags & 0x2 and parts[3] != "00:00:00:00:00:00":  # ATF_COM: entry resolved
+                    neighbors[parts[0]] = parts[3].lower()
+        return neighbors
+    except Exception as e:
+        logger.debug("Could not read /proc/net/arp: %s", e)
+
+    try:
+        import subprocess
+
+        result = subprocess.run(["ip", "-4", "neigh", "show"], capture_output=True, text=True, timeout=2)
+        for line in result.stdout.splitlines():
+            # 192.168.1.5 dev eth0 lladdr aa:bb:cc:dd:ee:ff REACHABLE
+            parts = line.split()
+            if "lladdr" not in parts or parts[-1] in ("FAILED", "INCOMPLETE"):
+                continue
+            neighbors[parts[0]] = parts[parts.index("lladdr") + 1].lower()
     except Exception as e:
-        logger.warning("Invalid scan range %s: %s", spec, e)
-    return []
+        logger.debug("Could not run ip neigh: %s", e)
+    return neighbors
 
 
-def _sync_connect(ip: str, port: int) -> str | None:
-    """Synchronous port check. Returns IP if connect succeeds."""
+def _neighbor_table_limit() -> int:
+    """Hard size limit of the kernel neighbor table (gc_thresh3, 1024 by default)."""
     try:
-        sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-        sock.settimeout(SCAN_TIMEOUT)
-        sock.connect((ip, port))
+        with open("/proc/sys/net/ipv4/neigh/default/gc_thresh3") as f:
+            return int(f.read())
+    except (OSError, ValueError):
+        return 1024
+
+
+async def _prewarm_neighbors(ips: Iterable[str]) -> dict[str, str]:
+    """
+    Send one UDP datagram (discard port) to each address so the kernel ARP-resolves
+    it. Far cheaper than a TCP handshake; live hosts then show up in the neighbor table.
+    Addresses go out in chunks of well under the table's size limit and the table is
+    read after each chunk: one burst over a whole slice would have the kernel evict
+    resolved entries before they are read. Returns the resolved neighbors {ip: mac}.
+    """
+    chunk = max(PREWARM_BURST, min(PREWARM_CHUNK, _neighbor_table_limit() // 2))
+    neighbors: dict[str, str] = {}
+    sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    sock.setblocking(False)
+    try:
+        n = 0
+        for n, ip in enumerate(ips, 1):
+            try:
+                sock.sendto(b"", (ip, 9))
+            except OSError:
+                pass  # unresolved-neighbor queue full or no route; the slow pass covers it
+            if n % chunk == 0:
+                await asyncio.sleep(PREWARM_CHUNK_WAIT)
+                neighbors.update(read_neighbor_table())
+            elif n % PREWARM_BURST == 0:
+                await asyncio.sleep(0.01)
+    finally:
         sock.close()
-        return ip
+    await asyncio.sleep(PREWARM_WAIT)
+    neighbors.update(read_neighbor_table())
+    return neighbors
+
+
+def _max_in_flight() -> int:
+    """Concurrency cap, kept below the process open-file limit (one socket per probe)."""
+    try:
+        import resource
+
+        soft, hard = resource.getrlimit(resource.RLIMIT_NOFILE)
+        wanted = MAX_CONCURRENT + FD_HEADROOM
+        if soft != resource.RLIM_INFINITY and soft < wanted:
+            # Raise the soft limit as far as the hard limit allows
+            new_soft = wanted if hard == resource.RLIM_INFINITY else min(wanted, hard)
+            resource.setrlimit(resource.RLIMIT_NOFILE, (new_soft, hard))
+            soft = new_soft
+        if soft != resource.RLIM_INFINITY:
+            return max(1, min(MAX_CONCURRENT, soft - FD_HEADROOM))
     except Exception:
-        return None
+        pass
+    return MAX_CONCURRENT
+
+
+class ProbeController:
+    """
+    AIMD controller for probe concurrency and per-probe timeout.
+
+    Answered probes (connected or refused) give RTT samples; the timeout follows
+    srtt + 4 * rttvar like TCP's RTO. The window doubles per clean window until the
+    first congestion signal (slow start), then grows by AI_STEP. It halves on RTT
+    inflation over the observed floor, on a timeout rate well above the sweep's
+    baseline (dead hosts time out at a steady rate; drops show up as a surge),
+    or on local socket exhaustion.
+    """
+
+    def __init__(self, max_window: int, window: float = INITIAL_CONCURRENT, timeout: float = SCAN_TIMEOUT):
+        self.max_window = max(1, max_window)
+        self.min_window = min(MIN_CONCURRENT, self.max_window)
+        self.window = min(max(window, self.min_window), self.max_window)
+        self.timeout = timeout
+        self.slow_start = True
+        self.in_flight = 0
+        self.srtt: float | None = None
+        self.rttvar = 0.0
+        self.min_rtt: float | None = None
+        self.baseline_timeout_rate: float | None = None
+        self.counts = {"open": 0, "closed": 0, "unreachable": 0, "timeout": 0, "error": 0}
+        self.peak_window = self.window
+        self.decreases = 0
+        self._cond = asyncio.Condition()
+        self._epoch_done = 0
+        self._epoch_timeouts = 0
+        self._epoch_rtt_sum = 0.0
+        self._epoch_rtt_n = 0
+        self._epoch_errors = 0
+
+    async def acquire(self) -> None:
+        async with self._cond:
+            await self._cond.wait_for(lambda: self.in_flight < int(self.window))
+            self.in_flight += 1
+
+    async def release(self, outcome: str, rtt: float | None) -> None:
+        self.in_flight -= 1
+        self._record(outcome, rtt)
+        async with self._cond:
+            self._cond.notify(max(1, int(self.window) - self.in_flight))
 
+    def _record(self, outcome: str, rtt: float | None) -> None:
+        self.counts[outcome] = self.counts.get(outcome, 0) + 1
+        self._epoch_done += 1
+        if outcome == "timeout":
+            self._epoch_timeouts += 1
+        elif outcome == "error":
+            self._epoch_errors += 1
+        elif outcome in ("open", "closed") and rtt is not None:
+            self._add_rtt(rtt)
+        if self._epoch_done >= max(int(self.window), self.min_window):
+            self._end_epoch()
 
-async def _check_port(ip: str, port: int, semaphore: asyncio.Semaphore) -> str | None:
-    """Try to connect to IP:port. Returns IP if successful."""
-    async with semaphore:
-        loop = asyncio.get_event_loop()
+    def _add_rtt(self, rtt: float) -> None:
+        self.min_rtt = rtt if self.min_rtt is None else min(self.min_rtt, rtt)
+        if self.srtt is None:
+            self.srtt, self.rttvar = rtt, rtt / 2
+        else:
+            self.rttvar = 0.75 * self.rttvar + 0.25 * abs(self.srtt - rtt)
+            self.srtt = 0.875 * self.srtt + 0.125 * rtt
+        self.timeout = min(MAX_PROBE_TIMEOUT, max(MIN_PROBE_TIMEOUT, self.srtt + 4 * self.rttvar))
+        self._epoch_rtt_sum += rtt
+        self._epoch_rtt_n += 1
+
+    def _end_epoch(self) -> None:
+        rate = self._epoch_timeouts / self._epoch_done
+        congested = self._epoch_errors > 0
+        if self.baseline_timeout_rate is not None and rate > self.baseline_timeout_rate + 0.2:
+            congested = True
+        if self._epoch_rtt_n and self.min_rtt is not None:
+            mean_rtt = self._epoch_rtt_sum / self._epoch_rtt_n
+            if mean_rtt > max(3 * self.min_rtt, self.min_rtt + 0.005):
+                congested = True
+
+        if congested:
+            self.window = max(self.min_window, self.window / 2)
+            self.slow_start = False
+            self.decreases += 1
+        elif self.slow_start:
+            self.window = min(self.max_window, self.window * 2)
+        else:
+            self.window = min(self.max_window, self.window + AI_STEP)
+        self.peak_window = max(self.peak_window, self.window)
+
+        # Only clean epochs move the baseline, so a surge is not absorbed into it
+        if not congested:
+            if self.baseline_timeout_rate is None:
+                self.baseline_timeout_rate = rate
+            else:
+                self.baseline_timeout_rate = 0.8 * self.baseline_timeout_rate + 0.2 * rate
+        self._epoch_done = self._epoch_timeouts = self._epoch_errors = self._epoch_rtt_n = 0
+        self._epoch_rtt_sum = 0.0
+
+    def stats(self) -> dict:
+        probes = sum(self.counts.values())
+        return {
+            "probes": probes,
+            **self.counts,
+            "timeout_rate": round(self.counts["timeout"] / probes, 3) if probes else 0.0,
+            "concurrency": int(self.window),
+            "peak_concurrency": int(self.peak_window),
+            "decreases": self.decreases,
+            "probe_timeout_s": round(self.timeout, 3),
+            "srtt_ms": round(self.srtt * 1000, 2) if self.srtt is not None else None,
+            "min_rtt_ms": round(self.min_rtt * 1000, 2) if self.min_rtt is not None else None,
+        }
+
+
+async def _exchange(loop: asyncio.AbstractEventLoop, sock: socket.socket, request: bytes) -> bytes:
+    """Send one request on a connected socket and read the reply until EOF."""
+    await loop.sock_sendall(sock, request)
+    chunks, size = [], 0
+    while size < MAX_RESPONSE_BYTES:
+        chunk = await loop.sock_recv(sock, 4096)
+        if not chunk:
+            break
+        chunks.append(chunk)
+        size += len(chunk)
+    return b"".join(chunks)
+
+
+async def _probe(
+    ip: str,
+    port: int,
+    timeout: float,
+    identify_timeout: float = 0.0,
+) -> tuple[str, float | None, dict | None]:
+    """
+    Non-blocking connect on the event loop (no thread per probe).
+    With identify_timeout, a read-only summary is requested on the same connection
+    and the miner info parsed from it (None if the host is not a WhatsMiner).
+    Returns (outcome, rtt, info): outcome is open, closed (refused), unreachable,
+    timeout or error (local).
+    """
+    loop = asyncio.get_running_loop()
+    try:
+        sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    except OSError:
+        return "error", None, None
+    sock.setblocking(False)
+    start = loop.time()
+    try:
+        await asyncio.wait_for(loop.sock_connect(sock, (ip, port)), timeout=timeout)
+        rtt = loop.time() - start
+        if not identify_timeout:
+            return "open", rtt, None
         try:
-            result = await asyncio.wait_for(
-                loop.run_in_executor(None, _sync_connect, ip, port),
-                timeout=SCAN_TIMEOUT + 1,
-            )
-            return result
-        except asyncio.TimeoutError:
-            return None
-        except Exception as e:
-            logger.debug("Scan %s:%s failed: %s", ip, port, e)
-            return None
+            reply = await asyncio.wait_for(_exchange(loop, sock, SUMMARY_REQUEST), timeout=identify_timeout)
+        except (OSError, asyncio.TimeoutError):
+            return "open", rtt, None
+        summary = parse_api_response(reply)
+        info = extract_miner_info(summary) if summary else None
+        if info:
+            info["ip"] = ip  # the address we reached, not what the firmware reports
+        return "open", rtt, info
+    except ConnectionRefusedError:
+        return "closed", loop.time() - start, None
+    except asyncio.TimeoutError:
+        return "timeout", None, None
+    except OSError as e:
+        if e.errno in _LOCAL_CONGESTION_ERRNOS:
+            return "error", None, None
+        return "unreachable", None, None
+    except Exception as e:
+        logger.debug("Scan %s:%s failed: %s", ip, port, e)
+        return "error", None, None
+    finally:
+        sock.close()
+
+
+async def identify_miner(ip: str, port: int = DEFAULT_PORT, timeout: float = SCAN_TIMEOUT) -> dict | None:
+    """Probe one address on a single connection. Returns miner info (mac, model, ...) or None."""
+    _, _, info = await _probe(ip, port, timeout, IDENTIFY_TIMEOUT)
+    return info
+
+
+async def _sweep(
+    ips: Iterable[str],
+    port: int,
+    controller: ProbeController,
+    cache: ScanCache | None = None,
+    identify: bool = False,
+    on_found: Callable[[str | dict], None] | None = None,
+) -> list:
+    """
+    Probe ips with a fixed pool of workers pulling from one shared iterator.
+    Memory is bounded by the pool size, not by the size of the range; the
+    controller decides how many of the workers may have a probe in flight.
+    Returns open IPs, or miner info dicts for identified WhatsMiners when identify
+    is set (other devices with the port open count as misses). Definitive outcomes
+    are recorded in cache; on_found is called with each hit as soon as it is made.
+    """
+    it = iter(ips)
+    found: list = []
+    identify_timeout = IDENTIFY_TIMEOUT if identify else 0.0
+
+    async def worker():
+        for ip in it:
+            # A local error (out of sockets, buffers) says nothing about the host:
+            # the controller has shrunk the window, so try the address again
+            for _ in range(1 + LOCAL_ERROR_RETRIES):
+                await controller.acquire()
+                outcome, rtt, info = "error", None, None
+                try:
+                    outcome, rtt, info = await _probe(ip, port, controller.timeout, identify_timeout)
+                finally:
+                    await controller.release(outcome, rtt)
+                if outcome != "error":
+                    break
+            hit = info is not None if identify else outcome == "open"
+            if cache is not None and outcome != "error":
+                cache.record(ip, hit)
+            if hit:
+                found.append(info if identify else ip)
+                if on_found is not None:
+                    on_found(found[-1])
+
+    await asyncio.gather(*(worker() for _ in range(controller.max_window)))
+    return found
+
+
+async def _background_sweep(
+    spec: str,
+    ips: Iterable[str],
+    port: int,
+    cache: ScanCache | None,
+    identify: bool,
+) -> None:
+    """Slow pass over addresses with no neighbor entry; hits are merged into the next scan."""
+    controller = ProbeController(BACKGROUND_CONCURRENCY, window=BACKGROUND_CONCURRENCY)
+    controller.slow_start = False
+    try:
+        found = await _sweep(ips, port, controller, cache, identify)
+        if found:
+            _background_found.setdefault(spec, set()).update(_hit_ip(hit) for hit in found)
+        logger.info("Background scan %s: %d found, %s", spec, len(found), controller.stats())
+    except Exception as e:
+        logger.warning("Background scan %s failed: %s", spec, e)
+    finally:
+        _background_tasks.pop(spec, None)
+
+
+async def _neighbor_scan(
+    spec: str,
+    intervals: list[tuple[int, int]],
+    addresses: Callable[[], Iterator[str]],
+    port: int,
+    controller: ProbeController,
+    cache: ScanCache | None,
+    identify: bool,
+    on_found: Callable[[str | dict], None] | None,
+) -> tuple[list, int]:
+    """
+    Probe addresses in the range with a resolved neighbor entry (after a cheap pre-warm
+    of this slice) plus earlier background hits and cached live hosts; start a slow
+    background pass over the rest of the slice. Returns (found, number of candidates probed).
+    """
+    neighbors = await _prewarm_neighbors(addresses())
+    carried = _background_found.pop(spec, set())
+    if cache is not None:
+        carried.update(cache.live_ips())
+    candidates = sorted(
+        (
+            ip for ip in neighbors.keys() | carried
+            if _in_ranges(intervals, ip) and (cache is None or cache.should_probe(ip))
+        ),
+        key=ipaddress.IPv4Address,
+    )
+    found = await _sweep(candidates, port, controller, cache, identify, on_found)
+
+    if spec not in _background_tasks:
+        known = set(candidates)
+        rest = (ip for ip in addresses() if ip not in known)
+        _background_tasks[spec] = asyncio.create_task(_background_sweep(spec, rest, port, cache, identify))
+    return found, len(candidates)
+
+
+def _hit_ip(hit: str | dict) -> str:
+    return hit["ip"] if isinstance(hit, dict) else hit
+
+
+async def _scan(
+    scan_range: str | None,
+    port: int,
+    mode: str,
+    slice_size: int,
+    cache: ScanCache | None,
+    identify: bool,
+    on_found: Callable[[str | dict], None] | None = None,
+) -> list:
+    """Shared body of scan_for_miners and discover_miners."""
+    spec = scan_range or _get_default_scan_range()
+    intervals = _parse_intervals(spec)
+    total = _range_size(intervals)
+    if not total:
+        return []
+
+    offset, count = 0, total
+    if slice_size and total > slice_size:
+        offset = _slice_cursor.get(spec, 0) % total
+        count = min(slice_size, total - offset)
+        _slice_cursor[spec] = (offset + count) % total
+
+    live = [ip for ip in cache.live_ips() if _in_ranges(intervals, ip)] if cache is not None else []
+    live_set = set(live)
+
+    def addresses() -> Iterator[str]:
+        ips = _iter_addresses(intervals, offset, count)
+        if cache is None:
+            return ips
+        return (ip for ip in ips if ip not in live_set and cache.should_probe(ip))
+
+    loop = asyncio.get_running_loop()
+    started = loop.time()
+    learned = _learned.get(spec, {})
+    controller = ProbeController(
+        min(_max_in_flight(), total),
+        window=learned.get("window", INITIAL_CONCURRENT),
+        timeout=learned.get("timeout", SCAN_TIMEOUT),
+    )
+    extra = {"mode": mode, "slice": f"{offset}+{count}/{total}"}
+    if mode == "neighbor":
+        found, extra["candidates"] = await _neighbor_scan(
+            spec, intervals, addresses, port, controller, cache, identify, on_found,
+        )
+        extra["background_running"] = spec in _background_tasks
+    else:
+        found = await _sweep(chain(live, addresses()), port, controller, cache, identify, on_found)
+    if cache is not None:
+        extra["cache"] = cache.stats()
+    # Start the next sweep at half the converged window, like a restart after idle
+    _learned[spec] = {"window": max(INITIAL_CONCURRENT, controller.window / 2), "timeout": controller.timeout}
+
+    last_scan_stats.clear()
+    last_scan_stats.update(controller.stats(), **extra, range=spec, found=len(found), duration_s=round(loop.time() - started, 2))
+    logger.info("Scan %s: %s", spec, last_scan_stats)
+    return sorted(found, key=lambda hit: ipaddress.IPv4Address(_hit_ip(hit)))
 
 
 async def scan_for_miners(
     scan_range: str | None = None,
     port: int = DEFAULT_PORT,
+    mode: str = "full",
+    slice_size: int = 0,
+    cache: ScanCache | None = None,
 ) -> list[str]:
     """
     Scan LAN for devices with port open (WhatsMiner API port).
-    Returns list of IP addresses.
+    mode "full" probes every address; "neighbor" probes addresses the kernel
+    neighbor table knows first and leaves the rest to a slow background pass.
+    With slice_size, ranges larger than that are swept one slice per call,
+    round-robin, so each call costs at most slice_size probes.
+    With a cache, known-live hosts in the range are probed every call and dead
+    addresses are skipped until their backoff expires.
+    Returns list of IP addresses. Parameters chosen by the probe controller are
+    kept in last_scan_stats.
+    """
+    return await _scan(scan_range, port, mode, slice_size, cache, identify=False)
+
+
+async def discover_miners(
+    scan_range: str | None = None,
+    port: int = DEFAULT_PORT,
+    mode: str = "full",
+    slice_size: int = 0,
+    cache: ScanCache | None = None,
+    on_found: Callable[[dict], None] | None = None,
+) -> list[dict]:
+    """
+    Like scan_for_miners, but each open port is sent a read-only summary request on
+    the probe connection. Only hosts answering as a WhatsMiner are returned, as
+    miner info dicts (mac, ip, model, hashrate, ...) ready for metrics.
+    on_found(info) is called for each miner as soon as it is identified.
+    """
+    return await _scan(scan_range, port, mode, slice_size, cache, identify=True, on_found=on_found)
+
+
+async def _find_mac(ips: Iterable[str], mac: str, port: int, concurrency: int) -> dict | None:
+    """Identify ips until one answers with mac; stops the sweep at the first match."""
+    target = mac.lower()
+    match: asyncio.Future = asyncio.get_running_loop().create_future()
+
+    def on_found(info: dict):
+        if info["mac"].lower() == target and not match.done():
+            match.set_result(info)
+
+    controller = ProbeController(concurrency, window=concurrency)
+    sweep = asyncio.ensure_future(_sweep(ips, port, controller, None, True, on_found))
+    try:
+        await asyncio.wait({sweep, match}, return_when=asyncio.FIRST_COMPLETED)
+    finally:
+        sweep.cancel()
+    return match.result() if match.done() else None
+
+
+class _LocateSweep:
+    """
+    One pre-warmed sweep of a whole range that identifies every miner it reaches.
+    Each miner being located registers its MAC and waits; the sweep stops once
+    nobody is waiting any more. However many miners are missing, at most one
+    such sweep (at _max_in_flight() sockets) runs per range.
+    """
+
+    def __init__(self, key: tuple[str, int], intervals: list[tuple[int, int]]):
+        self.key = key
+        self.intervals = intervals
+        self.found: dict[str, dict] = {}  # mac -> info, for miners that join late
+        self.waiters: dict[str, list[asyncio.Future]] = {}
+        self.task = asyncio.create_task(self._run())
+
+    async def wait(self, mac: str) -> dict | None:
+        if mac in self.found:
+            return self.found[mac]
+        future = asyncio.get_running_loop().create_future()
+        self.waiters.setdefault(mac, []).append(future)
+        try:
+            return await future
+        finally:
+            if future in self.waiters.get(mac, ()):
+                self.waiters[mac].remove(future)
+                if not self.waiters[mac]:
+                    del self.waiters[mac]
+            self._stop_if_idle()
+
+    def _on_found(self, info: dict) -> None:
+        mac = info["mac"].lower()
+        self.found[mac] = info
+        for future in self.waiters.pop(mac, []):
+            if not future.done():
+                future.set_result(info)
+        self._stop_if_idle()
+
+    def _stop_if_idle(self) -> None:
+        if not self.waiters and not self.task.done():
+            self._detach()
+            self.task.cancel()
+
+    def _detach(self) -> None:
+        if _locate_sweeps.get(self.key) is self:
+            del _locate_sweeps[self.key]  # later callers start a fresh sweep
+
+    async def _run(self) -> None:
+        spec, port = self.key
+        try:
+            neighbors = await _prewarm_neighbors(_iter_addresses(self.intervals))
+            # Addresses where a wanted MAC already resolved go first
+            first = [ip for ip, hw in neighbors.items() if hw in self.waiters and _in_ranges(self.intervals, ip)]
+            skip = set(first)
+            ips = chain(first, (ip for ip in _iter_addresses(self.intervals) if ip not in skip))
+            concurrency = _max_in_flight()
+            await _sweep(ips, port, ProbeController(concurrency, window=concurrency), None, True, self._on_found)
+        except Exception as e:
+            logger.warning("Locate sweep of %s failed: %s", spec, e)
+        finally:
+            self._detach()
+            for futures in self.waiters.values():
+                for future in futures:
+                    if not future.done():
+                        future.set_result(None)
+
+
+async def _locate_in_sweep(spec: str, intervals: list[tuple[int, int]], port: int, mac: str) -> dict | None:
+    """Wait for mac in the shared full sweep of the range, starting it if none is running."""
+    sweep = _locate_sweeps.get((spec, port))
+    if sweep is None:
+        sweep = _locate_sweeps[(spec, port)] = _LocateSweep((spec, port), intervals)
+    return await sweep.wait(mac)
+
+
+async def locate_miner(
+    mac: str,
+    last_ip: str | None = None,
+    scan_range: str | None = None,
+    port: int = DEFAULT_PORT,
+    recently_freed: Iterable[str] = (),
+    full_sweep: bool = True,
+) -> dict | None:
+    """
+    Find the current address of a miner whose IP changed (DHCP), cheapest step first:
+    the kernel neighbor table, addresses near last_ip, recently freed addresses, then
+    (if full_sweep) a pre-warmed neighbor table and a sweep of the whole range.
+    Every hit is verified by the MAC in the miner's summary. Returns miner info or None.
     """
     spec = scan_range or _get_default_scan_range()
-    ips = _parse_scan_range(spec)
-    if not ips:
-        return []
+    intervals = _parse_intervals(spec)
+    target = mac.lower()
+    tried: set[str] = set()
 
-    semaphore = asyncio.Semaphore(MAX_CONCURRENT)
-    tasks = [_check_port(ip, port, semaphore) for ip in ips]
-    results = await asyncio.gather(*tasks, return_exceptions=True)
+    async def attempt(ips: Iterable[str], concurrency: int = LOCATE_CONCURRENCY) -> dict | None:
+        fresh = [ip for ip in ips if ip not in tried]
+        tried.update(fresh)
+        return await _find_mac(fresh, mac, port, concurrency) if fresh else None
 
-    found = []
-    for r in results:
-        if isinstance(r, str):
-            found.append(r)
-        elif isinstance(r, Exception):
-            logger.debug("Scan error: %s", r)
-    return found
+    def from_neighbors() -> list[str]:
+        return [ip for ip, hw in read_neighbor_table().items() if hw == target]
+
+    info = await attempt(from_neighbors())
+    if info is None and last_ip:
+        base = int(ipaddress.IPv4Address(last_ip))
+        nearby = []
+        for delta in range(1, LOCATE_NEARBY + 1):
+            for n in (base + delta, base - delta):
+                ip = socket.inet_ntoa((n & 0xFFFFFFFF).to_bytes(4, "big"))
+                if _in_ranges(intervals, ip):
+                    nearby.append(ip)
+        info = await attempt([last_ip] + nearby)
+    if info is None:
+        info = await attempt(recently_freed)
+    if info is None and full_sweep:
+        info = await _locate_in_sweep(spec, intervals, port, target)
+    if info:
+        logger.info("Located miner %s at %s", mac, info["ip"])
+    return info
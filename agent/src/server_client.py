@@ -2,56 +2,218 @@
 import asyncio
 import json
 import logging
+import time
+import zlib
 from typing import Any
 
+try:
+    import msgpack
+except ImportError:  # without msgpack the agent offers JSON only
+    msgpack = None
+
 logger = logging.getLogger(__name__)
 
+METRICS_ACK_TIMEOUT = 30.0
+
+# WebSocket subprotocols, preferred first: binary msgpack frames or JSON text frames.
+# A server that picks neither (older versions) gets JSON.
+CODEC_MSGPACK = "minerhub.msgpack"
+CODEC_JSON = "minerhub.json"
+CODEC_SAMPLE_EVERY = 50  # every Nth message is also sized as JSON and deflated, to measure the saving
+
+_ws = None  # current server connection, for send_metrics()
+_codec: str | None = None  # negotiated on the current connection
+_codec_stats = {
+    "messages": 0, "bytes": 0, "encode_s": 0.0, "deflate": False,
+    "sampled_json": 0, "sampled_encoded": 0, "sampled_deflated": 0,
+}
+_metrics_acks: dict[int, asyncio.Future] = {}
+_next_batch_id = 0
+_command_tasks: set[asyncio.Task] = set()  # running commands; they outlive a reconnect
+
+
+class MetricsRefused(Exception):
+    """The server did not take a metrics batch (busy, over quota, disconnected)."""
+
+    def __init__(self, message: str, retry_after: float | None = None):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+
+async def send_metrics(lines: list[str]) -> None:
+    """
+    Push one batch of line protocol to the server, which merges it into its own
+    InfluxDB writes, and wait for the ack. Raises MetricsRefused when the batch
+    was not taken, so the caller keeps it (retry, then spool).
+    """
+    global _next_batch_id
+    ws = _ws
+    if ws is None:
+        raise MetricsRefused("not connected to server")
+    _next_batch_id += 1
+    batch_id = _next_batch_id
+    ack = _metrics_acks[batch_id] = asyncio.get_running_loop().create_future()
+    try:
+        await ws.send(_encode({"type": "metrics", "batch_id": batch_id, "lines": lines}))
+        result = await asyncio.wait_for(ack, timeout=METRICS_ACK_TIMEOUT)
+    except asyncio.TimeoutError:
+        raise MetricsRefused("no ack from server") from None
+    except MetricsRefused:
+        raise
+    except Exception as e:
+        raise MetricsRefused(f"send failed: {e}") from e
+    finally:
+        _metrics_acks.pop(batch_id, None)
+    if result.get("status") != "ok":
+        raise MetricsRefused(f"server {result.get('status')}", result.get("retry_after"))
+
+
+def _encode(msg: dict) -> str | bytes:
+    """Encode an outgoing message in the negotiated codec, counting size and CPU time."""
+    started = time.perf_counter()
+    data = msgpack.packb(msg, use_bin_type=True) if _codec == CODEC_MSGPACK else json.dumps(msg)
+    stats = _codec_stats
+    stats["encode_s"] += time.perf_counter() - started
+    stats["messages"] += 1
+    stats["bytes"] += len(data)  # json.dumps output is ASCII, so characters are bytes
+    if stats["messages"] % CODEC_SAMPLE_EVERY == 1:
+        raw = data if isinstance(data, bytes) else data.encode()
+        stats["sampled_json"] += len(json.dumps(msg)) if isinstance(data, bytes) else len(raw)
+        stats["sampled_encoded"] += len(raw)
+        if stats["deflate"]:
+            # One message on its own; with context takeover the real wire size is smaller still
+            deflater = zlib.compressobj(wbits=-15, memLevel=5)
+            stats["sampled_deflated"] += len(deflater.compress(raw) + deflater.flush(zlib.Z_SYNC_FLUSH)) - 4
+    return data
+
+
+def _decode(raw: str | bytes) -> dict:
+    if isinstance(raw, bytes):
+        return msgpack.unpackb(raw, raw=False)
+    return json.loads(raw)
+
+
+def codec_stats() -> dict:
+    """
+    Outgoing message stats: codec in use, messages and encoded bytes sent,
+    mean encode time, and from sampled messages the size saved against plain
+    JSON by the codec (saved_pct) and by codec plus deflate (deflated_pct).
+    """
+    stats = _codec_stats
+    json_bytes = stats["sampled_json"]
+    return {
+        "codec": "msgpack" if _codec == CODEC_MSGPACK else "json",
+        "messages": stats["messages"],
+        "bytes": stats["bytes"],
+        "encode_us": round(stats["encode_s"] / stats["messages"] * 1e6, 1) if stats["messages"] else None,
+        "saved_pct": round(100 * (1 - stats["sampled_encoded"] / json_bytes), 1) if json_bytes else None,
+        "deflated_pct": round(100 * (1 - stats["sampled_deflated"] / json_bytes), 1) if json_bytes and stats["deflate"] else None,
+    }
+
+
+def _fail_metrics_acks(reason: str) -> None:
+    for future in _metrics_acks.values():
+        if not future.done():
+            future.set_exception(MetricsRefused(reason))
+
 
 async def run_websocket(
     server_url: str,
     token: str,
     on_command: callable,
     on_connected: callable = None,
+    codec: str = "msgpack",
+    compression: str = "deflate",
 ) -> None:
     """
     Connect to server WebSocket and process commands.
-    on_command(cmd_dict) -> result dict to send back.
+    on_command(cmd_dict, send) -> result dict to send back; send(msg) is a coroutine
+    for intermediate messages while the command runs.
+
+    Every command runs in its own task and its result is sent when it finishes,
+    in completion order, so the reader keeps answering pings, acks and new
+    commands while a rescan runs. send() always uses the current connection:
+    a command that finishes after a reconnect still reports its result.
+
+    codec "msgpack" offers binary msgpack frames (if the msgpack package is
+    installed) with JSON as fallback; "json" offers JSON only. compression
+    "deflate" offers permessage-deflate, "none" turns it off.
     """
     import websockets
 
+    global _ws, _codec
+    offered = [CODEC_MSGPACK, CODEC_JSON] if codec == "msgpack" and msgpack is not None else [CODEC_JSON]
+    deflate = "deflate" if compression == "deflate" else None
     ws_url = server_url.replace("http://", "ws://").replace("https://", "wss://")
     url = f"{ws_url}/agents/ws?token={token}"
 
+    async def send(msg: dict):
+        ws = _ws
+        if ws is None:
+            raise ConnectionError("not connected to server")
+        await ws.send(_encode(msg))
+
+    async def run_command(cmd: dict):
+        command_id = cmd.get("command_id")
+        try:
+            res = on_command(cmd, send)
+            result = await res if asyncio.iscoroutine(res) else res
+        except Exception as e:
+            logger.exception("Command %s (%s) failed: %s", command_id, cmd.get("type"), e)
+            if command_id is None:
+                return
+            result = {"type": "command_result", "command_id": command_id, "status": "failed", "result": {"error": str(e)}}
+        if result is not None:
+            try:
+                await send(result)
+            except Exception as e:
+                logger.warning("Could not send result of command %s: %s", command_id, e)
+
     while True:
         try:
-            async with websockets.connect(url, ping_interval=20, ping_timeout=10) as ws:
-                logger.info("Connected to server")
+            async with websockets.connect(
+                url, ping_interval=20, ping_timeout=10, subprotocols=offered, compression=deflate,
+            ) as ws:
+                _codec = ws.subprotocol
+                # websockets < 14 exposes extensions on the connection, newer versions on its protocol
+                extensions = getattr(ws, "extensions", None) or getattr(getattr(ws, "protocol", None), "extensions", [])
+                _codec_stats["deflate"] = any(ext.name == "permessage-deflate" for ext in extensions)
+                logger.info(
+                    "Connected to server (%s%s)",
+                    "msgpack" if _codec == CODEC_MSGPACK else "json",
+                    ", deflate" if _codec_stats["deflate"] else "",
+                )
+                _ws = ws
                 if on_connected:
                     on_connected()
 
-                async def send_pong():
-                    await ws.send(json.dumps({"type": "pong"}))
-
                 while True:
                     try:
                         msg = await asyncio.wait_for(ws.recv(), timeout=35)
-                        data = json.loads(msg)
+                        data = _decode(msg)
 
                         if data.get("type") == "ping":
-                            await ws.send(json.dumps({"type": "pong"}))
+                            await ws.send(_encode({"type": "pong"}))
+                            continue
+
+                        if data.get("type") == "metrics_ack":
+                            future = _metrics_acks.get(data.get("batch_id"))
+                            if future is not None and not future.done():
+                                future.set_result(data)
                             continue
 
                         # Handle commands from server
-                        cmd = data
-                        res = on_command(cmd)
-                        result = await res if asyncio.iscoroutine(res) else res
-                        if result is not None:
-                            await ws.send(json.dumps(result))
+                        task = asyncio.create_task(run_command(data))
+                        _command_tasks.add(task)
+                        task.add_done_callback(_command_tasks.discard)
                     except asyncio.TimeoutError:
-                        await ws.send(json.dumps({"type": "ping"}))
+                        await ws.send(_encode({"type": "ping"}))
 
         except Exception as e:
             logger.warning("WebSocket disconnected: %s", e)
+        finally:
+            _ws = None
+            _fail_metrics_acks("disconnected from server")
         await asyncio.sleep(5)
 
 
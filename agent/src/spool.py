@@ -0,0 +1,155 @@
+"""On-disk write-ahead spool for metric batches that could not be written to InfluxDB."""
+import logging
+import os
+import struct
+import time
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_MAX_BYTES = 64 << 20
+DEFAULT_SEGMENT_BYTES = 1 << 20
+FSYNC_INTERVAL = 30.0  # seconds; data since the last fsync can be lost on power loss, not on a crash
+
+_HEADER = struct.Struct(">I")  # record length
+_SUFFIX = ".seg"
+
+
+class Spool:
+    """
+    FIFO of byte records in append-only segment files (<seq>.seg, length-prefixed
+    records). Appends go to the newest segment and are fsynced when a segment is
+    closed or at most every FSYNC_INTERVAL seconds, so an SD card sees few syncs.
+    Records are read oldest first; a segment is deleted once fully read. Past
+    max_bytes whole segments are evicted oldest first.
+
+    The read position is not persisted: after a restart the oldest segment is
+    replayed from its start, which is harmless for InfluxDB (same series and
+    timestamp overwrite).
+    """
+
+    def __init__(self, directory: str, max_bytes: int = DEFAULT_MAX_BYTES, segment_bytes: int = DEFAULT_SEGMENT_BYTES):
+        self.directory = directory
+        self.max_bytes = max(max_bytes, segment_bytes)
+        self.segment_bytes = segment_bytes
+        os.makedirs(directory, exist_ok=True)
+        self._segments: list[int] = sorted(
+            int(name[:-len(_SUFFIX)]) for name in os.listdir(directory)
+            if name.endswith(_SUFFIX) and name[:-len(_SUFFIX)].isdigit()
+        )
+        self._sizes = {seq: os.path.getsize(self._path(seq)) for seq in self._segments}
+        self._records = {seq: self._count(seq) for seq in self._segments}
+        self._writer = None  # open file of the newest segment
+        self._synced_at = time.monotonic()
+        self._read_offset = 0  # in the oldest segment
+        self._read_done = 0  # records already read from the oldest segment
+        self.evicted = 0  # records dropped to stay under max_bytes
+
+    def _path(self, seq: int) -> str:
+        return os.path.join(self.directory, f"{seq:010d}{_SUFFIX}")
+
+    def _count(self, seq: int) -> int:
+        count = 0
+        with open(self._path(seq), "rb") as f:
+            while (header := f.read(_HEADER.size)) and len(header) == _HEADER.size:
+                (length,) = _HEADER.unpack(header)
+                if len(f.read(length)) < length:
+                    break  # torn tail from a crash mid-append
+                count += 1
+        return count
+
+    def append(self, record: bytes) -> None:
+        if self._writer is None or self._sizes[self._segments[-1]] >= self.segment_bytes:
+            self._rotate()
+        seq = self._segments[-1]
+        self._writer.write(_HEADER.pack(len(record)) + record)
+        self._writer.flush()
+        self._sizes[seq] += _HEADER.size + len(record)
+        self._records[seq] += 1
+        if time.monotonic() - self._synced_at >= FSYNC_INTERVAL:
+            self._sync()
+        self._evict()
+
+    def peek(self) -> bytes | None:
+        """Oldest unread record, or None if the spool is empty."""
+        while self._segments:
+            seq = self._segments[0]
+            if seq == self._current_seq():
+                self._writer.flush()
+            with open(self._path(seq), "rb") as f:
+                f.seek(self._read_offset)
+                header = f.read(_HEADER.size)
+                if len(header) == _HEADER.size:
+                    (length,) = _HEADER.unpack(header)
+                    record = f.read(length)
+                    if len(record) == length:
+                        return record
+            if seq == self._current_seq():
+                return None  # caught up with the writer
+            self._drop_oldest()  # fully read (or torn tail)
+        return None
+
+    def commit(self) -> None:
+        """Mark the record returned by peek() as done."""
+        if not self._segments:
+            return
+        seq = self._segments[0]
+        with open(self._path(seq), "rb") as f:
+            f.seek(self._read_offset)
+            (length,) = _HEADER.unpack(f.read(_HEADER.size))
+        self._read_offset += _HEADER.size + length
+        self._read_done += 1
+        if self._read_offset >= self._sizes[seq] and seq != self._current_seq():
+            self._drop_oldest()
+
+    def depth(self) -> dict:
+        records = sum(self._records.values()) - self._read_done
+        return {
+            "records": max(records, 0),
+            "bytes": sum(self._sizes.values()) - self._read_offset,
+            "segments": len(self._segments),
+            "evicted": self.evicted,
+        }
+
+    def __len__(self) -> int:
+        return self.depth()["records"]
+
+    def close(self) -> None:
+        if self._writer is not None:
+            self._sync()
+            self._writer.close()
+            self._writer = None
+
+    def _current_seq(self) -> int | None:
+        return self._segments[-1] if self._writer is not None else None
+
+    def _rotate(self) -> None:
+        if self._writer is not None:
+            self._sync()
+            self._writer.close()
+        seq = self._segments[-1] + 1 if self._segments else 1
+        self._writer = open(self._path(seq), "ab")
+        self._segments.append(seq)
+        self._sizes[seq] = 0
+        self._records[seq] = 0
+
+    def _sync(self) -> None:
+        self._writer.flush()
+        os.fsync(self._writer.fileno())
+        self._synced_at = time.monotonic()
+
+    def _drop_oldest(self) -> None:
+        seq = self._segments.pop(0)  # never the segment being appended to
+        try:
+            os.remove(self._path(seq))
+        except OSError as e:
+            logger.warning("Could not remove spool segment %s: %s", seq, e)
+        del self._sizes[seq]
+        del self._records[seq]
+        self._read_offset = 0
+        self._read_done = 0
+
+    def _evict(self) -> None:
+        while len(self._segments) > 1 and sum(self._sizes.values()) > self.max_bytes:
+            self.evicted += self._records[self._segments[0]] - self._read_done
+            logger.warning("Spool over %d bytes; evicting oldest segment", self.max_bytes)
+            self._drop_oldest()
@@ -0,0 +1,135 @@
+"""Agent state on disk (SQLite, WAL): miner inventory, agent identity and scan cache survive restarts."""
+import hashlib
+import json
+import sqlite3
+import threading
+import time
+import zlib
+from array import array
+
+# Inventory fields worth keeping across restarts: enough to find and command a
+# miner again. Telemetry is re-read by the first poll.
+MINER_FIELDS = ("ip", "last_ip", "model", "worker", "firmware", "psu_model")
+LAST_SEEN_RESOLUTION = 600.0  # last_seen alone is rewritten at most this often per miner
+SCAN_SAVE_INTERVAL = 1800.0  # dead-address table is big; dead entries expire within the backoff max anyway
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS miners (mac TEXT PRIMARY KEY, info TEXT NOT NULL, last_seen REAL);
+CREATE TABLE IF NOT EXISTS kv (key TEXT PRIMARY KEY, value BLOB NOT NULL);
+"""
+
+
+class StateStore:
+    """
+    Small SQLite database next to the agent. WAL with synchronous=NORMAL: a
+    crash never corrupts it and a power cut loses at most the last save.
+    Writes are batched into one transaction per save and skip unchanged
+    rows, so the SD card sees a handful of small writes per minute.
+
+    Methods are blocking; call them via asyncio.to_thread with snapshots of
+    the in-memory state (a lock serializes them).
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(path, isolation_level=None, check_same_thread=False)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute("PRAGMA synchronous=NORMAL")
+        self._db.executescript(_SCHEMA)
+        self._saved: dict[str, tuple[str, float]] = {}  # mac -> (info json, last_seen) as stored
+        self._scan_saved_at = 0.0
+
+    def load_miners(self) -> dict[str, dict]:
+        with self._lock:
+            rows = self._db.execute("SELECT mac, info, last_seen FROM miners").fetchall()
+        miners = {}
+        for mac, info, last_seen in rows:
+            self._saved[mac] = (info, last_seen or 0.0)
+            miners[mac] = {**json.loads(info), "mac": mac, "last_seen": last_seen or 0.0}
+        return miners
+
+    def save_miners(self, miners: dict[str, dict]) -> int:
+        """Upsert miners whose stored fields changed (or whose last_seen is stale). Returns rows written."""
+        rows = []
+        for mac, miner in miners.items():
+            info = json.dumps({k: miner.get(k) for k in MINER_FIELDS if miner.get(k) is not None}, sort_keys=True)
+            last_seen = float(miner.get("last_seen") or 0.0)
+            saved = self._saved.get(mac)
+            if saved and saved[0] == info and last_seen - saved[1] < LAST_SEEN_RESOLUTION:
+                continue
+            rows.append((mac, info, last_seen))
+        if not rows:
+            return 0
+        with self._lock, self._db:
+            self._db.execute("BEGIN")
+            self._db.executemany(
+                "INSERT INTO miners (mac, info, last_seen) VALUES (?, ?, ?) "
+                "ON CONFLICT(mac) DO UPDATE SET info = excluded.info, last_seen = excluded.last_seen",
+                rows,
+            )
+        for mac, info, last_seen in rows:
+            self._saved[mac] = (info, last_seen)
+        return len(rows)
+
+    def load_identity(self, token: str) -> dict | None:
+        """Agent info saved for this AGENT_TOKEN (None after a reinstall with a new token)."""
+        value = self._get("agent_info")
+        if value is None:
+            return None
+        stored = json.loads(value)
+        if stored.pop("token_hash", None) != _token_hash(token):
+            return None
+        return stored
+
+    def save_identity(self, token: str, info: dict) -> None:
+        self._put("agent_info", json.dumps({**info, "token_hash": _token_hash(token)}))
+
+    def load_scan_cache(self, cache) -> None:
+        """Fill a ScanCache with the saved live hosts and dead-address backoffs."""
+        live = self._get("scan_live")
+        if live is not None:
+            cache.live.update(json.loads(live))
+        dead = self._get("scan_dead")
+        if dead is not None:
+            pairs = array("q")
+            pairs.frombytes(zlib.decompress(dead))
+            cache.dead.update(zip(pairs[::2], pairs[1::2]))
+
+    def scan_save_due(self) -> bool:
+        return time.monotonic() - self._scan_saved_at >= SCAN_SAVE_INTERVAL
+
+    def save_scan_cache(self, live: dict[str, float], dead: dict[int, int]) -> None:
+        """Save a snapshot of a ScanCache's live hosts and dead-address backoffs."""
+        pairs = array("q")
+        for key, packed in dead.items():
+            pairs.append(key)
+            pairs.append(packed)
+        with self._lock, self._db:
+            self._db.execute("BEGIN")
+            self._put_locked("scan_live", json.dumps(live))
+            self._put_locked("scan_dead", zlib.compress(pairs.tobytes(), 6))
+        self._scan_saved_at = time.monotonic()
+
+    def close(self) -> None:
+        with self._lock:
+            self._db.close()
+
+    def _get(self, key: str):
+        with self._lock:
+            row = self._db.execute("SELECT value FROM kv WHERE key = ?", (key,)).fetchone()
+        return row[0] if row else None
+
+    def _put(self, key: str, value) -> None:
+        with self._lock:
+            self._put_locked(key, value)
+
+    def _put_locked(self, key: str, value) -> None:
+        self._db.execute(
+            "INSERT INTO kv (key, value) VALUES (?, ?) ON CONFLICT(key) DO UPDATE SET value = excluded.value",
+            (key, value),
+        )
+
+
+def _token_hash(token: str) -> str:
+    return hashlib.sha256(token.encode()).hexdigest()[:16]
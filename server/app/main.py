@@ -10,7 +10,7 @@ from fastapi.staticfiles import StaticFiles
 from app.database import init_db, async_session_maker
 from app.routers import farms, agents, miners, ws, influx, auth, users
 from app.models import Farm, Agent, Miner, Command, User  # noqa: F401 - ensure models are registered
-from app.services import user_service
+from app.services import user_service, metrics_service
 
 
 async def bootstrap_admin():
@@ -27,10 +27,12 @@ async def bootstrap_admin():
 
 @asynccontextmanager
 async def lifespan(app: FastAPI):
-    """Startup: init DB, bootstrap admin. Shutdown: nothing."""
+    """Startup: init DB, bootstrap admin, start metrics ingest. Shutdown: flush metrics ingest."""
     await init_db()
     await bootstrap_admin()
+    await metrics_service.start_ingest()
     yield
+    await metrics_service.stop_ingest()
 
 
 app = FastAPI(
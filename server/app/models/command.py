@@ -12,9 +12,11 @@ class CommandType(str, enum.Enum):
     RESTART = "restart"
     UPDATE_WORKER = "update_worker"
     GET_REALTIME = "get_realtime"
+    GET_HISTORY = "get_history"
     POWER_OFF = "power_off"
     POWER_ON = "power_on"
     RESCAN = "rescan"
+    BULK = "bulk"  # one action on many miners of an agent; params hold action and MACs
 
 
 class CommandStatus(str, enum.Enum):
@@ -1,18 +1,22 @@
 """Agent CRUD, install/uninstall scripts."""
+import asyncio
+import json
 import os
 from fastapi import APIRouter, Depends, HTTPException, Query
-from fastapi.responses import PlainTextResponse
+from fastapi.responses import PlainTextResponse, StreamingResponse
 from pydantic import BaseModel
 from sqlalchemy.ext.asyncio import AsyncSession
 
 from app.database import get_db
 from app.auth import get_current_user
 from app.models import User
-from app.services import agent_service, farm_service
+from app.services import agent_service, farm_service, metrics_service
 from app.models import Agent
 
 router = APIRouter(tags=["agents"])
 
+SCAN_STREAM_TIMEOUT = 120.0  # seconds a streamed scan may run before the stream ends
+
 
 def _get_server_url() -> str:
     return os.getenv("SERVER_URL", "http://localhost:8000").rstrip("/")
@@ -109,6 +113,16 @@ async def get_install_script(
     influx_token = os.getenv("INFLUXDB_TOKEN", "minertoken1234567890")
     influx_org = os.getenv("INFLUXDB_ORG", "miner-org")
     influx_bucket = os.getenv("INFLUXDB_BUCKET", "miner-metrics")
+    if metrics_service.ingest_enabled():
+        # The server writes the agents' metrics: no InfluxDB credentials on the Pi
+        metrics_env = "METRICS_SINK=server"
+    else:
+        metrics_env = (
+            f"INFLUXDB_URL={influx_url}\n"
+            f"INFLUXDB_TOKEN={influx_token}\n"
+            f"INFLUXDB_ORG={influx_org}\n"
+            f"INFLUXDB_BUCKET={influx_bucket}"
+        )
 
     script = f"""#!/bin/bash
 set -e
@@ -137,17 +151,14 @@ cd "$INSTALL_DIR"
 # Create venv and install deps
 python3 -m venv venv
 ./venv/bin/pip install --upgrade pip
-./venv/bin/pip install whatsminer influxdb-client websockets aiohttp
+./venv/bin/pip install pycryptodome websockets aiohttp msgpack
 
 # Create config
 mkdir -p src
 cat > src/.env << 'ENVEOF'
 AGENT_TOKEN={agent.token}
 SERVER_URL={api_url}
-INFLUXDB_URL={influx_url}
-INFLUXDB_TOKEN={influx_token}
-INFLUXDB_ORG={influx_org}
-INFLUXDB_BUCKET={influx_bucket}
+{metrics_env}
 ENVEOF
 
 # Download and extract agent source
@@ -175,6 +186,7 @@ EnvironmentFile=$INSTALL_DIR/src/.env
 ExecStart=$INSTALL_DIR/venv/bin/python main.py
 Restart=always
 RestartSec=10
+LimitNOFILE=8192
 Environment=PATH=$INSTALL_DIR/venv/bin:/usr/bin
 
 [Install]
@@ -294,7 +306,7 @@ async def get_agent(
 # --- Commands and Scan ---
 
 class CommandCreate(BaseModel):
-    type: str  # restart, update_worker, power_off, power_on, get_realtime
+    type: str  # restart, update_worker, power_off, power_on, get_realtime, get_history
     miner_id: int | None = None
     params: dict | None = None
 
@@ -306,7 +318,7 @@ async def queue_command(
     db: AsyncSession = Depends(get_db),
     user: User = Depends(get_current_user),
 ):
-    """Queue a command for the agent (restart, update_worker, power_off, power_on, get_realtime)."""
+    """Queue a command for the agent (restart, update_worker, power_off, power_on, get_realtime, get_history)."""
     from app.models import Command, CommandStatus, CommandType
 
     agent = await agent_service.get_agent_by_id(db, agent_id)
@@ -335,14 +347,74 @@ async def queue_command(
     return {"status": "queued", "command_id": cmd.id}
 
 
+@router.get("/agents/{agent_id}/commands/{command_id}")
+async def get_command(
+    agent_id: int,
+    command_id: int,
+    db: AsyncSession = Depends(get_db),
+    user: User = Depends(get_current_user),
+):
+    """Get command status and result (a running scan has the miners discovered so far)."""
+    from app.models import Command
+
+    cmd = await db.get(Command, command_id)
+    if not cmd or cmd.agent_id != agent_id:
+        raise HTTPException(status_code=404, detail="Command not found")
+    return {
+        "id": cmd.id,
+        "type": cmd.type,
+        "miner_id": cmd.miner_id,
+        "status": cmd.status,
+        "result": cmd.result,
+        "created_at": cmd.created_at.isoformat() if cmd.created_at else None,
+    }
+
+
+def _stream_scan(command_id: int, queue: asyncio.Queue):
+    """NDJSON stream of scan_progress messages followed by the final scan_result."""
+    from app.websocket import close_scan_stream
+
+    async def events():
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + SCAN_STREAM_TIMEOUT
+        try:
+            yield json.dumps({"type": "started", "command_id": command_id}) + "\n"
+            while True:
+                try:
+                    msg = await asyncio.wait_for(queue.get(), timeout=max(0.0, deadline - loop.time()))
+                except asyncio.TimeoutError:
+                    yield json.dumps({"type": "error", "error": "scan timeout"}) + "\n"
+                    return
+                yield json.dumps(msg) + "\n"
+                if msg.get("type") in ("scan_result", "error"):
+                    return
+        finally:
+            close_scan_stream(command_id)
+
+    return StreamingResponse(events(), media_type="application/x-ndjson")
+
+
 @router.post("/agents/{agent_id}/scan")
 async def trigger_scan(
     agent_id: int,
+    stream: bool = Query(False, description="Stream discovered miners as NDJSON while the scan runs"),
     db: AsyncSession = Depends(get_db),
     user: User = Depends(get_current_user),
 ):
-    """Trigger scan for new miners. Agent must be online (WebSocket) to respond."""
+    """
+    Trigger scan for new miners. Agent must be online (WebSocket) to respond.
+    With stream=true, returns NDJSON lines (scan_progress with miners as they are
+    identified, then scan_result); otherwise waits for the full result.
+    Progress can also be polled at /agents/{agent_id}/commands/{command_id}.
+    """
     from app.models import Command, CommandStatus, CommandType
+    from app.websocket import (
+        broadcast_to_agent,
+        close_scan_stream,
+        is_agent_online,
+        open_scan_stream,
+        send_command_to_agent,
+    )
 
     agent = await agent_service.get_agent_by_id(db, agent_id)
     if not agent:
@@ -357,13 +429,21 @@ async def trigger_scan(
     )
     db.add(cmd)
     await db.flush()
+    # Commit now so progress messages from the agent (separate session) can update the row
+    await db.commit()
+
+    payload = {"type": "rescan", "command_id": cmd.id}
+    if stream and is_agent_online(agent_id):
+        queue = open_scan_stream(agent_id, cmd.id)
+        if await broadcast_to_agent(agent_id, payload):
+            return _stream_scan(cmd.id, queue)
+        close_scan_stream(cmd.id)
 
     # Try to forward to WebSocket if agent is connected
-    from app.websocket import send_command_to_agent
-    result = await send_command_to_agent(agent_id, {"type": "rescan", "command_id": cmd.id})
+    result = await send_command_to_agent(agent_id, payload)
     discovered = result.get("discovered", []) if result else None
     if discovered is not None:
-        return {"status": "completed", "discovered": discovered or []}
+        return {"status": "completed", "discovered": discovered or [], "scan_stats": result.get("scan_stats") or {}}
 
     return {
         "status": "queued",
@@ -13,9 +13,13 @@ async def query_metrics(
     user: User = Depends(get_current_user),
     farm_id: str | None = Query(None),
     miner_mac: str | None = Query(None),
+    measurement: str = Query("miner_metrics", pattern=r"^[A-Za-z0-9_]+$"),
     limit: int = Query(100, le=1000),
 ):
-    """Query InfluxDB for miner metrics. Use with Grafana or custom charts."""
+    """
+    Query InfluxDB for miner metrics (the miner_metrics measurement unless another
+    one, e.g. miner_board or agent_status, is asked for). Use with Grafana or custom charts.
+    """
     url = os.getenv("INFLUXDB_URL", "http://localhost:8086")
     token = os.getenv("INFLUXDB_TOKEN", "")
     org = os.getenv("INFLUXDB_ORG", "miner-org")
@@ -29,6 +33,7 @@ async def query_metrics(
         from datetime import datetime, timedelta, timezone
 
         query = f'from(bucket: "{bucket}") |> range(start: -1h)'
+        query += f' |> filter(fn: (r) => r["_measurement"] == "{measurement}")'
         if farm_id:
             query += f' |> filter(fn: (r) => r["farm_id"] == "{farm_id}")'
         if miner_mac:
@@ -1,8 +1,8 @@
-"""Miner CRUD and actions (restart, power_off, power_on, realtime)."""
+"""Miner CRUD and actions (restart, power_off, power_on, realtime, history, bulk)."""
 import asyncio
 from fastapi import APIRouter, Depends, HTTPException, Query
 from sqlalchemy.ext.asyncio import AsyncSession
-from pydantic import BaseModel
+from pydantic import BaseModel, Field
 
 from app.database import get_db
 from app.auth import get_current_user
@@ -22,6 +22,26 @@ class MinerUpdate(BaseModel):
     password: str | None = None
 
 
+class BulkCommand(BaseModel):
+    action: str  # restart, power_off, power_on or update_worker
+    farm_id: int | None = None
+    model: str | None = None  # case-insensitive prefix, e.g. "M30S" also matches "M30S++"
+    macs: list[str] | None = None
+    concurrency: int = Field(16, ge=1, le=64)  # miners handled at once by each agent
+    stagger: float = Field(0, ge=0, le=60)  # seconds between starts
+    worker1: str | None = None
+    worker2: str | None = None
+    worker3: str | None = None
+
+
+BULK_ACTIONS = (
+    CommandType.RESTART.value,
+    CommandType.POWER_OFF.value,
+    CommandType.POWER_ON.value,
+    CommandType.UPDATE_WORKER.value,
+)
+
+
 def _miner_to_dict(m: Miner) -> dict:
     return {
         "id": m.id,
@@ -47,6 +67,72 @@ async def list_miners(
     return [_miner_to_dict(m) for m in miners]
 
 
+@router.post("/bulk")
+async def bulk_command(
+    data: BulkCommand,
+    db: AsyncSession = Depends(get_db),
+    user: User = Depends(get_current_user),
+):
+    """
+    Run one action on many miners (a farm, a model, a MAC list or a combination).
+    Each agent gets a single bulk command for its miners and streams per-miner
+    results into that command's result; poll /commands/{id} for progress.
+    """
+    if data.action not in BULK_ACTIONS:
+        raise HTTPException(status_code=400, detail=f"action must be one of {', '.join(BULK_ACTIONS)}")
+    if data.farm_id is None and not data.model and not data.macs:
+        raise HTTPException(status_code=400, detail="Select miners by farm_id, model or macs")
+
+    miners = await miner_service.list_miners(db, farm_id=data.farm_id)
+    if data.model:
+        model = data.model.lower()
+        miners = [m for m in miners if (m.model or "").lower().startswith(model)]
+    if data.macs:
+        macs = {mac.lower() for mac in data.macs}
+        miners = [m for m in miners if m.mac.lower() in macs]
+    if not miners:
+        raise HTTPException(status_code=404, detail="No miners match")
+
+    workers = {}
+    if data.action == CommandType.UPDATE_WORKER.value:
+        workers = {k: v for k, v in (("worker1", data.worker1), ("worker2", data.worker2), ("worker3", data.worker3)) if v is not None}
+        for m in miners:
+            await miner_service.update_miner(db, m, **workers)
+
+    by_agent: dict[int, list[Miner]] = {}
+    for m in miners:
+        by_agent.setdefault(m.agent_id, []).append(m)
+
+    commands = []
+    payloads = []
+    for agent_id, agent_miners in by_agent.items():
+        params = {
+            "action": data.action,
+            "macs": [m.mac for m in agent_miners],
+            "concurrency": data.concurrency,
+            "stagger": data.stagger,
+            **workers,
+        }
+        cmd = _queue_command(db, agent_id, None, CommandType.BULK.value, params)
+        await db.flush()
+        payload = {
+            "type": CommandType.BULK.value,
+            "command_id": cmd.id,
+            "action": data.action,
+            "concurrency": data.concurrency,
+            "stagger": data.stagger,
+            "miners": [{"mac": m.mac, "password": get_miner_password(m) or ""} for m in agent_miners],
+            **workers,
+        }
+        payloads.append((agent_id, payload))
+        commands.append({"agent_id": agent_id, "command_id": cmd.id, "miners": len(agent_miners)})
+    # Commit before sending: a fast agent's result must find its command row
+    await db.commit()
+    for agent_id, payload in payloads:
+        asyncio.create_task(broadcast_to_agent(agent_id, payload))
+    return {"status": "queued", "miners": len(miners), "commands": commands}
+
+
 @router.get("/{miner_id}")
 async def get_miner(
     miner_id: int,
@@ -83,7 +169,7 @@ async def update_miner(
     return _miner_to_dict(miner)
 
 
-def _queue_command(db: AsyncSession, agent_id: int, miner_id: int, cmd_type: str, params: dict | None = None) -> Command:
+def _queue_command(db: AsyncSession, agent_id: int, miner_id: int | None, cmd_type: str, params: dict | None = None) -> Command:
     """Queue a command for the agent."""
     cmd = Command(
         agent_id=agent_id,
@@ -96,14 +182,16 @@ def _queue_command(db: AsyncSession, agent_id: int, miner_id: int, cmd_type: str
     return cmd
 
 
-def _broadcast_command(agent_id: int, miner: Miner, cmd_id: int, cmd_type: str):
-    """Broadcast command to agent if connected."""
+def _broadcast_command(agent_id: int, miner: Miner, cmd_id: int, cmd_type: str, params: dict | None = None):
+    """Broadcast command to agent if connected (read-only commands go without the password)."""
     payload = {
         "type": cmd_type,
         "command_id": cmd_id,
         "miner_mac": miner.mac,
-        "password": get_miner_password(miner) or "",
+        **(params or {}),
     }
+    if cmd_type not in (CommandType.GET_REALTIME.value, CommandType.GET_HISTORY.value):
+        payload["password"] = get_miner_password(miner) or ""
     asyncio.create_task(broadcast_to_agent(agent_id, payload))
 
 
@@ -167,8 +255,30 @@ async def get_realtime(
     miner = await miner_service.get_miner_by_id(db, miner_id)
     if not miner:
         raise HTTPException(status_code=404, detail="Miner not found")
-    # Queue command; in full impl, WebSocket would push result back
-    # For now return placeholder - agent will update command result
+    # The agent answers from its in-memory history when the last poll is recent enough
     cmd = _queue_command(db, miner.agent_id, miner_id, CommandType.GET_REALTIME.value)
     await db.flush()
+    # Commit first: the agent may answer from memory before this request's session would commit
+    await db.commit()
+    _broadcast_command(miner.agent_id, miner, cmd.id, CommandType.GET_REALTIME.value)
+    return {"status": "queued", "command_id": cmd.id, "message": "Poll /commands/{id} for result"}
+
+
+@router.get("/{miner_id}/history")
+async def get_history(
+    miner_id: int,
+    seconds: int | None = Query(None, ge=1),
+    db: AsyncSession = Depends(get_db),
+    user: User = Depends(get_current_user),
+):
+    """Recent samples kept in the agent's memory (last `seconds`, default the agent's whole window)."""
+    miner = await miner_service.get_miner_by_id(db, miner_id)
+    if not miner:
+        raise HTTPException(status_code=404, detail="Miner not found")
+    params = {"seconds": seconds} if seconds else {}
+    cmd = _queue_command(db, miner.agent_id, miner_id, CommandType.GET_HISTORY.value, params)
+    await db.flush()
+    # Commit first: the agent may answer from memory before this request's session would commit
+    await db.commit()
+    _broadcast_command(miner.agent_id, miner, cmd.id, CommandType.GET_HISTORY.value, params)
     return {"status": "queued", "command_id": cmd.id, "message": "Poll /commands/{id} for result"}
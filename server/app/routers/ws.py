@@ -1,15 +1,18 @@
 """WebSocket endpoint for agents."""
-import json
 import logging
 from fastapi import APIRouter, WebSocket, WebSocketDisconnect
 
 from app.database import async_session_maker
-from app.services import agent_service
-from app.models import Command, CommandStatus
+from app.services import agent_service, metrics_service
+from app.models import Command, CommandStatus, CommandType
 from app.websocket import (
     register_agent,
     unregister_agent,
     complete_pending_response,
+    publish_scan_message,
+    negotiate_codec,
+    decode_message,
+    send_message,
 )
 
 logger = logging.getLogger(__name__)
@@ -31,35 +34,75 @@ async def agent_websocket(websocket: WebSocket):
             await websocket.close(code=4001, reason="Invalid token")
             return
         agent_id = agent.id
+        # Tags the server stamps on every metric line this agent pushes
+        metric_tags = {
+            "farm_id": str(agent.farm_id),
+            "agent_id": str(agent.id),
+            "farm_name": agent.farm.name if agent.farm else "",
+        }
         await agent_service.update_agent_last_seen(db, agent)
         await db.commit()
 
-    register_agent(agent_id, websocket)
+    # msgpack when both sides have it; permessage-deflate is negotiated by the ASGI server
+    codec = negotiate_codec(websocket.scope.get("subprotocols") or [])
+    await websocket.accept(subprotocol=codec)
+    register_agent(agent_id, websocket, codec)
 
     try:
         while True:
-            data = await websocket.receive_text()
-            msg = json.loads(data)
+            message = await websocket.receive()
+            if message["type"] == "websocket.disconnect":
+                raise WebSocketDisconnect(message.get("code", 1000))
+            msg = decode_message(message)
 
             if msg.get("type") == "ping":
                 async with async_session_maker() as db:
                     await agent_service.update_agent_last_seen(db, agent_id)
                     await db.commit()
-                await websocket.send_json({"type": "pong"})
+                await send_message(websocket, {"type": "pong"}, codec)
+                continue
+
+            if msg.get("type") == "metrics":
+                ingest = metrics_service.get_ingest()
+                if ingest is None:
+                    ack = {"status": "disabled", "retry_after": 60}
+                else:
+                    ack = ingest.accept(agent_id, metric_tags, msg.get("lines") or [])
+                await send_message(websocket, {"type": "metrics_ack", "batch_id": msg.get("batch_id"), **ack}, codec)
+                continue
+
+            if msg.get("type") == "scan_progress":
+                command_id = msg.get("command_id")
+                miners = msg.get("miners", [])
+                async with async_session_maker() as db:
+                    from sqlalchemy import select
+                    result = await db.execute(select(Command).where(Command.id == command_id))
+                    cmd = result.scalar_one_or_none()
+                    if cmd:
+                        so_far = (cmd.result or {}).get("discovered", [])
+                        cmd.status = CommandStatus.RUNNING.value
+                        cmd.result = {"discovered": so_far + miners}
+                        await db.commit()
+                publish_scan_message(command_id, {"type": "scan_progress", "miners": miners})
                 continue
 
             if msg.get("type") == "scan_result":
                 command_id = msg.get("command_id")
                 discovered = msg.get("discovered", [])
+                scan_stats = msg.get("scan_stats") or {}
                 async with async_session_maker() as db:
                     from sqlalchemy import select
                     result = await db.execute(select(Command).where(Command.id == command_id))
                     cmd = result.scalar_one_or_none()
                     if cmd:
                         cmd.status = CommandStatus.COMPLETED.value
-                        cmd.result = {"discovered": discovered}
+                        cmd.result = {"discovered": discovered, "scan_stats": scan_stats}
                         await db.commit()
-                complete_pending_response(agent_id, {"discovered": discovered})
+                complete_pending_response(agent_id, {"discovered": discovered, "scan_stats": scan_stats})
+                publish_scan_message(
+                    command_id,
+                    {"type": "scan_result", "discovered": discovered, "scan_stats": scan_stats},
+                )
                 continue
 
             if msg.get("type") == "miner_upsert":
@@ -84,6 +127,10 @@ async def agent_websocket(websocket: WebSocket):
                     res = await db.execute(select(Command).where(Command.id == command_id))
                     cmd = res.scalar_one_or_none()
                     if cmd:
+                        if cmd.type == CommandType.BULK.value and isinstance(result, dict):
+                            # Bulk results arrive in batches: keep the per-miner results already received
+                            so_far = (cmd.result or {}).get("results", [])
+                            result = {**(cmd.result or {}), **result, "results": so_far + (result.get("results") or [])}
                         cmd.status = status
                         cmd.result = result
                         await db.commit()
@@ -91,8 +138,8 @@ async def agent_websocket(websocket: WebSocket):
 
     except WebSocketDisconnect:
         pass
-    except json.JSONDecodeError as e:
-        logger.warning("Invalid JSON from agent %s: %s", agent_id, e)
+    except ValueError as e:  # malformed JSON or msgpack
+        logger.warning("Invalid message from agent %s: %s", agent_id, e)
     except Exception as e:
         logger.exception("Agent WS error: %s", e)
     finally:
@@ -0,0 +1,266 @@
+"""Central metrics ingestion: agents push line protocol over their WebSocket, the server batches it into InfluxDB."""
+import asyncio
+import gzip
+import logging
+import os
+import random
+import time
+from collections import deque
+from contextlib import suppress
+
+logger = logging.getLogger(__name__)
+
+# Tags the server owns: whatever an agent sends for these is replaced
+SERVER_TAGS = ("farm_id", "agent_id", "farm_name")
+REQUIRED_TAGS = ("farm_id", "agent_id")  # set on every line; farm_name only where the agent had it
+
+
+def _split_unescaped(s: str, sep: str, maxsplit: int = -1) -> list[str]:
+    """Split on sep where it is not backslash-escaped (line protocol escaping)."""
+    parts, start, i = [], 0, 0
+    while maxsplit < 0 or len(parts) < maxsplit:
+        j = s.find(sep, i)
+        if j == -1:
+            break
+        k = j
+        while k > 0 and s[k - 1] == "\\":
+            k -= 1
+        if (j - k) % 2 == 0:
+            parts.append(s[start:j])
+            start = j + 1
+        i = j + 1
+    parts.append(s[start:])
+    return parts
+
+
+def _escape_tag(value: str) -> str:
+    return value.replace("\\", "\\\\").replace(",", "\\,").replace("=", "\\=").replace(" ", "\\ ")
+
+
+def enrich_line(line: str, tags: dict[str, str]) -> str | None:
+    """
+    Set the server-owned tags on one line of line protocol. Tags farm_name only
+    replaces an existing farm_name tag (agents on the stable tag schema leave it
+    out). Returns None for lines without a field set, lines with an embedded line
+    break (they would smuggle in extra points with tags of the agent's choosing)
+    and when tags lacks farm_id or agent_id.
+    """
+    if "\n" in line or "\r" in line or not all(tags.get(key) for key in REQUIRED_TAGS):
+        return None
+    series_and_rest = _split_unescaped(line, " ", 1)
+    if len(series_and_rest) != 2 or not series_and_rest[1].strip():
+        return None
+    series, rest = series_and_rest
+    measurement, *pairs = _split_unescaped(series, ",")
+    if not measurement:
+        return None
+    kept = []
+    had = set()
+    for pair in pairs:
+        key = _split_unescaped(pair, "=", 1)[0]
+        if key in SERVER_TAGS:
+            had.add(key)
+        else:
+            kept.append(pair)
+    for key in SERVER_TAGS:
+        value = tags.get(key)
+        if value and (key != "farm_name" or key in had):
+            kept.append(f"{key}={_escape_tag(str(value))}")
+    kept.sort(key=lambda pair: _split_unescaped(pair, "=", 1)[0])  # sorted tags, as the agents write them
+    return ",".join([measurement, *kept]) + " " + rest
+
+
+class _Rejected(Exception):
+    """InfluxDB refused the data itself (4xx); retrying cannot help."""
+
+
+class MetricsIngest:
+    """
+    One InfluxDB writer for all agents. accept() takes a batch of lines from an
+    agent and either queues it or refuses it:
+      - "quota": the agent is over its points/second allowance (token bucket);
+      - "busy": the shared queue is full because InfluxDB is slow or down.
+    Refused batches stay with the agent (memory queue, then disk spool) and are
+    resent after retry_after seconds, so backpressure reaches the agents instead
+    of data being dropped here. The queue is flushed in large gzipped batches.
+    """
+
+    def __init__(
+        self,
+        url: str,
+        token: str,
+        org: str,
+        bucket: str,
+        batch_size: int = 10000,
+        flush_interval: float = 2.0,
+        max_queue: int = 500000,
+        agent_rate: float = 2000.0,
+        agent_burst: float = 50000.0,
+        retry_max: float = 30.0,
+    ):
+        self.url, self.token, self.org, self.bucket = url.rstrip("/"), token, org, bucket
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.max_queue = max_queue
+        self.agent_rate = agent_rate
+        self.agent_burst = max(agent_burst, agent_rate)
+        self.retry_max = retry_max
+        self._queue: deque[str] = deque()
+        self._quota: dict[int, list[float]] = {}  # agent_id -> [tokens, refilled at]
+        self._ready = asyncio.Event()
+        self._task: asyncio.Task | None = None
+        self._closing = False
+        self._client = None
+        self.stats = {"accepted": 0, "written": 0, "busy": 0, "quota": 0, "invalid": 0, "requests": 0, "dropped": 0}
+
+    def start(self) -> None:
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self) -> None:
+        """Flush what is queued (one attempt per batch) and close the HTTP client."""
+        self._closing = True
+        if self._task:
+            self._task.cancel()
+            with suppress(asyncio.CancelledError):
+                await self._task
+            self._task = None
+        while self._queue:
+            batch = self._take()
+            try:
+                await self._write(batch)
+                self.stats["written"] += len(batch)
+            except Exception as e:
+                logger.error("Metrics flush on shutdown failed, dropping %d points: %s", len(batch), e)
+                self.stats["dropped"] += len(batch)
+        if self._client is not None:
+            await self._client.aclose()
+            self._client = None
+
+    def accept(self, agent_id: int, tags: dict[str, str], lines: list[str]) -> dict:
+        """Queue an agent's batch. Returns the ack for the agent: {status, retry_after?}."""
+        if not lines:
+            return {"status": "ok", "accepted": 0}
+        if len(self._queue) + len(lines) > self.max_queue:
+            self.stats["busy"] += 1
+            return {"status": "busy", "retry_after": self.flush_interval * 2}
+
+        now = time.monotonic()
+        bucket = self._quota.setdefault(agent_id, [self.agent_burst, now])
+        bucket[0] = min(self.agent_burst, bucket[0] + (now - bucket[1]) * self.agent_rate)
+        bucket[1] = now
+        if bucket[0] < len(lines):
+            self.stats["quota"] += 1
+            return {"status": "quota", "retry_after": round((len(lines) - bucket[0]) / self.agent_rate, 1)}
+        bucket[0] -= len(lines)
+
+        enriched = [e for e in (enrich_line(line, tags) for line in lines if isinstance(line, str)) if e]
+        self.stats["invalid"] += len(lines) - len(enriched)
+        self.stats["accepted"] += len(enriched)
+        self._queue.extend(enriched)
+        if len(self._queue) >= self.batch_size:
+            self._ready.set()
+        return {"status": "ok", "accepted": len(enriched)}
+
+    def status(self) -> dict:
+        return {**self.stats, "queued": len(self._queue), "agents": len(self._quota)}
+
+    async def _run(self) -> None:
+        while not self._closing:
+            with suppress(asyncio.TimeoutError):
+                await asyncio.wait_for(self._ready.wait(), timeout=self.flush_interval)
+            self._ready.clear()
+            while self._queue and not self._closing:
+                batch = self._take()
+                try:
+                    await self._write_with_retry(batch)
+                except asyncio.CancelledError:
+                    self._queue.extendleft(reversed(batch))  # stop() writes it
+                    raise
+                if len(self._queue) < self.batch_size:
+                    break
+
+    def _take(self) -> list[str]:
+        return [self._queue.popleft() for _ in range(min(self.batch_size, len(self._queue)))]
+
+    async def _write_with_retry(self, batch: list[str]) -> None:
+        """Retry until written; meanwhile the queue fills and accept() pushes back on agents."""
+        attempt = 0
+        while not self._closing:
+            try:
+                await self._write(batch)
+                self.stats["written"] += len(batch)
+                return
+            except _Rejected as e:
+                logger.error("InfluxDB rejected %d points, dropping: %s", len(batch), e)
+                self.stats["dropped"] += len(batch)
+                return
+            except Exception as e:
+                delay = min(self.retry_max, 2 ** attempt) * random.uniform(0.5, 1.0)
+                attempt += 1
+                logger.warning("InfluxDB write of %d points failed (%s); retrying in %.1fs", len(batch), e, delay)
+                await asyncio.sleep(delay)
+        self._queue.extendleft(reversed(batch))
+
+    async def _write(self, batch: list[str]) -> None:
+        import httpx
+
+        if self._client is None:
+            self._client = httpx.AsyncClient(
+                headers={"Authorization": f"Token {self.token}"},
+                timeout=30.0,
+            )
+        body = await asyncio.to_thread(gzip.compress, "\n".join(batch).encode(), 5)
+        self.stats["requests"] += 1
+        resp = await self._client.post(
+            f"{self.url}/api/v2/write",
+            params={"org": self.org, "bucket": self.bucket, "precision": "s"},
+            content=body,
+            headers={"Content-Encoding": "gzip", "Content-Type": "text/plain; charset=utf-8"},
+        )
+        if resp.status_code >= 300:
+            if resp.status_code == 429 or resp.status_code >= 500:
+                raise RuntimeError(f"HTTP {resp.status_code}: {resp.text[:200]}")
+            raise _Rejected(f"HTTP {resp.status_code}: {resp.text[:200]}")
+
+
+_ingest: MetricsIngest | None = None
+
+
+def ingest_enabled() -> bool:
+    return os.getenv("METRICS_INGEST", "").lower() in ("1", "true", "yes")
+
+
+def get_ingest() -> MetricsIngest | None:
+    """The server-wide ingest, if METRICS_INGEST is on (created by start_ingest)."""
+    return _ingest
+
+
+async def start_ingest() -> None:
+    global _ingest
+    if not ingest_enabled() or _ingest is not None:
+        return
+    token = os.getenv("INFLUXDB_TOKEN", "")
+    if not token:
+        logger.warning("METRICS_INGEST is on but INFLUXDB_TOKEN is not set; agents' metrics will be refused")
+        return
+    _ingest = MetricsIngest(
+        os.getenv("INFLUXDB_URL", "http://localhost:8086"),
+        token,
+        os.getenv("INFLUXDB_ORG", "miner-org"),
+        os.getenv("INFLUXDB_BUCKET", "miner-metrics"),
+        batch_size=int(os.getenv("METRICS_BATCH_SIZE", "10000")),
+        flush_interval=float(os.getenv("METRICS_FLUSH_INTERVAL", "2")),
+        max_queue=int(os.getenv("METRICS_MAX_QUEUE", "500000")),
+        agent_rate=float(os.getenv("METRICS_AGENT_RATE", "2000")),
+        agent_burst=float(os.getenv("METRICS_AGENT_BURST", "50000")),
+    )
+    _ingest.start()
+
+
+async def stop_ingest() -> None:
+    global _ingest
+    if _ingest is not None:
+        await _ingest.stop()
+        logger.info("Metrics ingest stopped: %s", _ingest.status())
+        _ingest = None
@@ -8,24 +8,69 @@ from fastapi import WebSocket
 
 logger = logging.getLogger(__name__)
 
+try:
+    import msgpack
+except ImportError:  # without msgpack every agent falls back to JSON
+    msgpack = None
+
+# WebSocket subprotocols agents offer, preferred first: binary msgpack frames,
+# or JSON text frames. Agents that offer neither (older installs) get JSON.
+CODEC_MSGPACK = "minerhub.msgpack"
+CODEC_JSON = "minerhub.json"
+
 # agent_id -> WebSocket
 _agent_connections: dict[int, WebSocket] = {}
+# agent_id -> negotiated subprotocol (None = plain JSON)
+_agent_codecs: dict[int, str | None] = {}
 # agent_id -> asyncio.Future for pending scan/command response
 _pending_responses: dict[int, asyncio.Future] = {}
+# command_id -> (agent_id, queue of scan_progress/scan_result messages) for streaming API callers
+_scan_streams: dict[int, tuple[int, asyncio.Queue]] = {}
+
+
+def negotiate_codec(offered: list[str]) -> str | None:
+    """Subprotocol to accept from the ones the agent offered (None = plain JSON)."""
+    if msgpack is not None and CODEC_MSGPACK in offered:
+        return CODEC_MSGPACK
+    if CODEC_JSON in offered:
+        return CODEC_JSON
+    return None
+
+
+def decode_message(message: dict[str, Any]) -> dict[str, Any]:
+    """Decode a received frame: binary frames are msgpack, text frames JSON. Raises ValueError if malformed."""
+    if message.get("bytes") is not None:
+        if msgpack is None:
+            raise ValueError("binary frame but msgpack is not installed")
+        return msgpack.unpackb(message["bytes"], raw=False)
+    return json.loads(message["text"])
+
+
+async def send_message(ws: WebSocket, payload: dict[str, Any], codec: str | None = None) -> None:
+    """Send payload in the connection's negotiated codec."""
+    if codec == CODEC_MSGPACK:
+        await ws.send_bytes(msgpack.packb(payload, use_bin_type=True))
+    else:
+        await ws.send_json(payload)
 
 
-def register_agent(agent_id: int, ws: WebSocket) -> None:
+def register_agent(agent_id: int, ws: WebSocket, codec: str | None = None) -> None:
     """Register agent WebSocket connection."""
     _agent_connections[agent_id] = ws
+    _agent_codecs[agent_id] = codec
     logger.info("Agent %s connected", agent_id)
 
 
 def unregister_agent(agent_id: int) -> None:
     """Unregister agent WebSocket."""
     _agent_connections.pop(agent_id, None)
+    _agent_codecs.pop(agent_id, None)
     future = _pending_responses.pop(agent_id, None)
     if future and not future.done():
         future.cancel()
+    for command_id, (stream_agent_id, _) in list(_scan_streams.items()):
+        if stream_agent_id == agent_id:
+            publish_scan_message(command_id, {"type": "error", "error": "agent disconnected"})
     logger.info("Agent %s disconnected", agent_id)
 
 
@@ -47,7 +92,7 @@ async def send_command_to_agent(agent_id: int, payload: dict[str, Any]) -> Any |
     _pending_responses[agent_id] = future
 
     try:
-        await ws.send_json(payload)
+        await send_message(ws, payload, _agent_codecs.get(agent_id))
         result = await asyncio.wait_for(future, timeout=120.0)
         return result
     except asyncio.TimeoutError:
@@ -69,13 +114,32 @@ def complete_pending_response(agent_id: int, result: Any) -> None:
         future.set_result(result)
 
 
+def open_scan_stream(agent_id: int, command_id: int) -> asyncio.Queue:
+    """Start collecting scan messages for a command. Call before sending the rescan."""
+    queue: asyncio.Queue = asyncio.Queue()
+    _scan_streams[command_id] = (agent_id, queue)
+    return queue
+
+
+def close_scan_stream(command_id: int) -> None:
+    """Stop collecting scan messages for a command."""
+    _scan_streams.pop(command_id, None)
+
+
+def publish_scan_message(command_id: int, msg: dict[str, Any]) -> None:
+    """Forward a scan_progress/scan_result message to a streaming caller, if any."""
+    stream = _scan_streams.get(command_id)
+    if stream:
+        stream[1].put_nowait(msg)
+
+
 async def broadcast_to_agent(agent_id: int, payload: dict[str, Any]) -> bool:
     """Send message to agent without waiting for response."""
     ws = _agent_connections.get(agent_id)
     if not ws:
         return False
     try:
-        await ws.send_json(payload)
+        await send_message(ws, payload, _agent_codecs.get(agent_id))
         return True
     except Exception as e:
         logger.exception("Error broadcasting to agent %s: %s", agent_id, e)
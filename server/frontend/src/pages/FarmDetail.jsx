@@ -101,11 +101,37 @@ export default function FarmDetail() {
     if (!farm?.agent?.id || scanning) return;
     setScanning(true);
     try {
-      const r = await apiFetch(`/agents/${farm.agent.id}/scan`, { method: "POST" });
-      const data = await r.json();
-      setDiscovered(data.discovered || []);
-      if (data.status === "queued") {
-        alert("Agent offline - scan queued. Run again when agent is connected.");
+      const r = await apiFetch(`/agents/${farm.agent.id}/scan?stream=true`, { method: "POST" });
+      if ((r.headers.get("content-type") || "").includes("application/x-ndjson")) {
+        // Miners arrive as scan_progress lines while the agent sweeps, then a final scan_result
+        setDiscovered([]);
+        const reader = r.body.getReader();
+        const decoder = new TextDecoder();
+        let buffer = "";
+        for (;;) {
+          const { value, done } = await reader.read();
+          if (done) break;
+          buffer += decoder.decode(value, { stream: true });
+          const lines = buffer.split("\n");
+          buffer = lines.pop();
+          for (const line of lines) {
+            if (!line.trim()) continue;
+            const msg = JSON.parse(line);
+            if (msg.type === "scan_progress") {
+              setDiscovered((d) => [...d, ...msg.miners.filter((m) => !d.some((x) => x.mac === m.mac))]);
+            } else if (msg.type === "scan_result") {
+              setDiscovered(msg.discovered || []);
+            } else if (msg.type === "error") {
+              console.error("Scan failed:", msg.error);
+            }
+          }
+        }
+      } else {
+        const data = await r.json();
+        setDiscovered(data.discovered || []);
+        if (data.status === "queued") {
+          alert("Agent offline - scan queued. Run again when agent is connected.");
+        }
       }
       load();
     } catch (e) {